@@ -0,0 +1,112 @@
+"""
+AlphaChat network worker.
+
+Started by gfxhat.py or 128x32oled.py when a chat is opened and kept running
+until they exit. It does the OpenAI SDK's HTTP, SSE parsing and response model work in
+its own process, so the UI process only receives text deltas and never competes
+with the SDK for the GIL.
+
+Messages in both directions are frames on stdin/stdout: a FRAME_HEADER
+(payload length, request id, kind) followed by the payload.
+  UI -> worker: CHAT (JSON request), CANCEL (no payload)
+  worker -> UI: DELTA (UTF-8 text), END (JSON usage and error)
+"""
+import json
+import struct
+import sys
+import threading
+
+from openai import OpenAI
+
+FRAME_HEADER = struct.Struct('<IIB')
+CHAT = 0
+CANCEL = 1
+DELTA = 2
+END = 3
+
+
+def read_frame(stream):
+    """Read one frame, returning (request id, kind, payload), or None at end of input."""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    length, request_id, kind = FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return request_id, kind, payload
+
+
+def write_frame(stream, request_id, kind, payload=b''):
+    stream.write(FRAME_HEADER.pack(len(payload), request_id, kind) + payload)
+    stream.flush()
+
+
+class Worker:
+    """Runs each chat request on its own thread and writes its frames to stdout."""
+
+    def __init__(self, output):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.cancelled = {}  # request id -> Event set when the UI cancels it
+        self.clients = {}  # (base_url, api_key, timeout) -> client, so connections stay warm
+
+    def send(self, request_id, kind, payload=b''):
+        with self.output_lock:
+            write_frame(self.output, request_id, kind, payload)
+
+    def get_client(self, request):
+        key = (request["base_url"], request["api_key"], request["timeout"])
+        if key not in self.clients:
+            self.clients[key] = OpenAI(api_key=request["api_key"], base_url=request["base_url"],
+                                       timeout=request["timeout"])
+        return self.clients[key]
+
+    def chat(self, request_id, request):
+        """Stream one request, sending text deltas and then an END frame."""
+        cancelled = self.cancelled[request_id]
+        usage = None
+        error = None
+        try:
+            response = self.get_client(request).chat.completions.create(
+                model=request["model"],
+                messages=request["messages"],
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in response:
+                if cancelled.is_set():
+                    response.close()
+                    break
+                if getattr(chunk, "usage", None):
+                    usage = {"prompt_tokens": chunk.usage.prompt_tokens,
+                             "completion_tokens": chunk.usage.completion_tokens}
+                if not chunk.choices:
+                    continue  # The final usage chunk carries no choices
+                content = chunk.choices[0].delta.content
+                if content:
+                    self.send(request_id, DELTA, content.encode('utf-8'))
+        except Exception as e:
+            error = str(e)
+        finally:
+            del self.cancelled[request_id]
+            self.send(request_id, END, json.dumps({"usage": usage, "error": error}).encode('utf-8'))
+
+    def run(self, stream):
+        """Read requests until the UI closes the pipe."""
+        while True:
+            frame = read_frame(stream)
+            if frame is None:
+                return
+            request_id, kind, payload = frame
+            if kind == CHAT:
+                self.cancelled[request_id] = threading.Event()
+                threading.Thread(target=self.chat, args=(request_id, json.loads(payload)), daemon=True).start()
+            elif kind == CANCEL:
+                cancelled = self.cancelled.get(request_id)
+                if cancelled is not None:
+                    cancelled.set()
+
+
+if __name__ == '__main__':
+    Worker(sys.stdout.buffer).run(sys.stdin.buffer)
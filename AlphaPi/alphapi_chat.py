@@ -0,0 +1,198 @@
+"""
+UI-side end of the AlphaChat worker process, shared by gfxhat.py and 128x32oled.py:
+chat requests streamed through alphachat_worker.py, and the channel that hands
+their output to a chat screen.
+"""
+import json
+import subprocess
+import sys
+import threading
+from collections import deque
+from os import path
+
+from alphachat_worker import CHAT, CANCEL, DELTA, END, read_frame, write_frame
+
+CHAT_WORKER_PATH = path.join(path.dirname(path.abspath(__file__)), 'alphachat_worker.py')
+CHUNK_CHANNEL_CAPACITY = 256  # Stream messages queued before further deltas are merged into the newest one
+
+
+class ChatRequest:
+    """One streamed request to the chat worker. Iterating yields its text deltas until it ends."""
+
+    def __init__(self, worker, request_id, process):
+        self.worker = worker
+        self.request_id = request_id
+        self.process = process  # Worker process serving the request
+        self.deltas = deque()
+        self.finished = False
+        self.usage = None  # {"prompt_tokens", "completion_tokens"} if the server reported them
+        self.error = None
+
+    def __iter__(self):
+        condition = self.worker.condition
+        while True:
+            with condition:
+                while not self.deltas and not self.finished:
+                    condition.wait()
+                if not self.deltas:
+                    return
+                text = self.deltas.popleft()
+            yield text
+
+    def cancel(self):
+        """Ask the worker to stop streaming this request, and end it here at once so iteration stops."""
+        if not self.finished:
+            self.worker.send(self, CANCEL)
+            self.worker.finish(self, None, "Stopped")
+
+
+class ChatWorker:
+    """
+    UI-side handle to the AlphaChat worker process (alphachat_worker.py), which does
+    the HTTP, SSE parsing and response model work outside the UI process.
+    The process is started when first needed and kept warm between chats; a reader
+    thread routes its frames to the ChatRequest they belong to. If the process exits,
+    its open requests end with an error and the next request starts a new one.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.requests = {}  # request id -> ChatRequest
+        self.next_id = 1
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker process if it is not running."""
+        with self.condition:
+            if self.process is None or self.process.poll() is not None:
+                self.process = subprocess.Popen(
+                    [sys.executable, CHAT_WORKER_PATH],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL  # Keep worker output off the curses screen
+                )
+                threading.Thread(target=self.read_frames, args=(self.process,), name="chat-worker-reader", daemon=True).start()
+            return self.process
+
+    def request(self, settings, model, messages):
+        """
+        Start streaming a chat completion and return its ChatRequest.
+        settings holds the backend's client arguments (api_key, base_url, timeout).
+        """
+        payload = json.dumps(dict(settings, model=model, messages=messages)).encode('utf-8')
+        process = self.start()
+        with self.condition:
+            request = ChatRequest(self, self.next_id, process)
+            self.requests[request.request_id] = request
+            self.next_id += 1
+        self.send(request, CHAT, payload)
+        return request
+
+    def send(self, request, kind, payload=b''):
+        try:
+            with self.write_lock:
+                write_frame(request.process.stdin, request.request_id, kind, payload)
+        except (OSError, ValueError) as e:
+            self.finish(request, None, "Chat worker is not running")
+
+    def finish(self, request, usage, error):
+        with self.condition:
+            if not request.finished:
+                request.usage, request.error, request.finished = usage, error, True
+                self.requests.pop(request.request_id, None)
+                self.condition.notify_all()
+
+    def read_frames(self, process):
+        """Reader loop for one worker process: route its frames to their requests."""
+        while True:
+            frame = read_frame(process.stdout)
+            if frame is None:
+                break
+            request_id, kind, payload = frame
+            with self.condition:
+                request = self.requests.get(request_id)
+            if request is None:
+                continue  # Cancelled and already given up on
+            if kind == DELTA:
+                with self.condition:
+                    request.deltas.append(payload.decode('utf-8', errors='replace'))
+                    self.condition.notify_all()
+            elif kind == END:
+                result = json.loads(payload)
+                self.finish(request, result.get("usage"), result.get("error"))
+        # The process exited: end every request it was serving
+        with self.condition:
+            orphaned = [request for request in self.requests.values() if request.process is process]
+        for request in orphaned:
+            self.finish(request, None, "Chat worker exited")
+
+
+# Shared by every chat; the worker process outlives individual chats
+chat_worker = ChatWorker()
+
+
+class ChunkChannel:
+    """
+    Bounded, thread-safe hand-off of stream messages from a producer thread to the UI loop.
+    Every message is a (seq, kind, text) tuple with an increasing sequence number.
+    put() never blocks: once capacity messages are queued, a delta is merged into
+    the newest queued delta, so the queue stays bounded and a chat streaming in the
+    background (with nobody draining it) never stalls. wait() lets the consumer
+    sleep until a message newer than the one it last saw arrives.
+    """
+
+    def __init__(self, capacity=CHUNK_CHANNEL_CAPACITY):
+        self.capacity = capacity
+        self.messages = deque()
+        self.seq = 0
+        self.closed = False
+        self.requests = []  # ChatRequests feeding the channel, cancelled when it is closed
+        self.condition = threading.Condition()
+
+    def attach(self, request):
+        """Cancel request when the channel is closed (at once if it already is)."""
+        with self.condition:
+            if not self.closed:
+                self.requests.append(request)
+                return
+        request.cancel()
+
+    def put(self, kind, text=""):
+        """Queue a message. Returns False once the channel is closed."""
+        with self.condition:
+            if self.closed:
+                return False
+            self.seq += 1
+            if kind == "delta" and len(self.messages) >= self.capacity and self.messages[-1][1] == "delta":
+                # Full, e.g. because nobody is viewing this chat: grow the newest delta instead
+                self.messages[-1] = (self.seq, kind, self.messages[-1][2] + text)
+            else:
+                self.messages.append((self.seq, kind, text))
+            self.condition.notify_all()
+            return True
+
+    def drain(self):
+        """Remove and return all queued messages, oldest first."""
+        with self.condition:
+            messages = list(self.messages)
+            self.messages.clear()
+        return messages
+
+    def wait(self, after_seq, timeout):
+        """Wait up to timeout seconds for a message newer than after_seq. Returns the latest seq."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > after_seq or self.closed, timeout)
+            return self.seq
+
+    def close(self):
+        """
+        Close the channel, discarding queued messages and cancelling attached requests,
+        so a producer waiting on a silent server stops at once rather than at its next put().
+        """
+        with self.condition:
+            self.closed = True
+            self.messages.clear()
+            requests, self.requests = self.requests, []
+            self.condition.notify_all()
+        for request in requests:
+            request.cancel()
@@ -0,0 +1,220 @@
+"""
+Word completion from a prefix trie of the library and past chats, shared by gfxhat.py and 128x32oled.py.
+"""
+import json
+import os
+import threading
+from collections import deque
+from os import listdir, path
+
+from alphapi_spelling import WORD_PATTERN, match_case
+from alphapi_tasks import PRIORITY_INDEXING, scheduler
+
+COMPLETION_INDEX_PATH = '/home/ninjinka/alphapi_completions.json'  # Persisted word counts for completion
+COMPLETION_MIN_PREFIX = 2  # Letters typed before a completion is offered
+COMPLETION_MIN_WORD_LENGTH = 4  # Shorter words are not worth completing
+
+
+class TrieNode:
+    """A prefix trie node caching the most frequent word at or below it."""
+
+    __slots__ = ("children", "count", "best", "best_count")
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0  # Frequency of the word ending at this node
+        self.best = None  # Most frequent word in this subtree
+        self.best_count = 0
+
+
+class CompletionIndex:
+    """
+    Frequency-weighted prefix trie over the words of the user's .txt library and past chats.
+    Every node caches the most frequent word below it, so complete() is a single walk
+    down the typed prefix and never searches. Updates (initial scan, saved documents,
+    chat messages) run on a worker thread; word counts per source are persisted to
+    COMPLETION_INDEX_PATH so startup only rescans library files that changed.
+    """
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.files = {}  # filename -> {"mtime": ..., "words": {word: count}}
+        self.chat_words = {}  # word -> count across past chats
+        self.pending = deque()  # (function, args) updates to apply
+        self.condition = threading.Condition()
+        self.started = False
+        self.scheduled = False  # A job applying updates is queued or running; only one runs at a time
+        self.dirty = False  # Counts changed since the index was last saved
+
+    def start(self):
+        """Load and refresh the index on the scheduler; that job then applies updates queued meanwhile."""
+        with self.condition:
+            if self.started:
+                return
+            self.started = self.scheduled = True
+        scheduler.submit(PRIORITY_INDEXING, self.load_and_scan, name="completion-load")
+
+    def submit(self, function, *args):
+        self.start()
+        with self.condition:
+            self.pending.append((function, args))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        scheduler.submit(PRIORITY_INDEXING, self.apply_pending, name="completion-index")
+
+    def complete(self, prefix):
+        """Returns the rest of the most frequent indexed word starting with prefix, or ''."""
+        if len(prefix) < COMPLETION_MIN_PREFIX:
+            return ""
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return ""
+        best = node.best
+        if best is None or len(best) <= len(prefix):
+            return ""
+        return match_case(prefix, best)[len(prefix):]
+
+    def adjust(self, word, delta):
+        """Change a word's count and refresh the cached best words along its path."""
+        nodes = [self.root]
+        for char in word:
+            nodes.append(nodes[-1].children.setdefault(char, TrieNode()))
+        nodes[-1].count += delta
+        for depth in range(len(word), -1, -1):
+            node = nodes[depth]
+            if node.count > 0:
+                node.best, node.best_count = word[:depth], node.count
+            else:
+                node.best, node.best_count = None, 0
+            for child in node.children.values():
+                if child.best_count > node.best_count:
+                    node.best, node.best_count = child.best, child.best_count
+            if depth and node.best is None:
+                del nodes[depth - 1].children[word[depth - 1]]  # Prune words no longer used
+
+    def apply_counts(self, old, new):
+        """Adjust the trie from one set of word counts for a source to another."""
+        for word in set(old) | set(new):
+            delta = new.get(word, 0) - old.get(word, 0)
+            if delta:
+                self.adjust(word, delta)
+        self.dirty = True
+
+    def update_file(self, filename, text=None):
+        """Re-count a library document (reading it if text is None). Runs on the worker."""
+        try:
+            if text is None:
+                with open(filename, 'r', errors='ignore') as f:
+                    text = f.read()
+            mtime = path.getmtime(filename)
+        except OSError:
+            text, mtime = "", None
+        old = self.files.pop(filename, {}).get("words", {})
+        new = count_words(text)
+        self.apply_counts(old, new)
+        if mtime is not None:
+            self.files[filename] = {"mtime": mtime, "words": new}
+
+    def add_chat(self, text):
+        """Add the words of a chat message. Runs on the worker."""
+        new = count_words(text)
+        merged = dict(self.chat_words)
+        for word, count in new.items():
+            merged[word] = merged.get(word, 0) + count
+        self.apply_counts(self.chat_words, merged)
+        self.chat_words = merged
+
+    def index_file(self, filename, text=None):
+        """Queue a saved document for re-indexing."""
+        self.submit(self.update_file, filename, text)
+
+    def index_chat(self, text):
+        """Queue a chat message for indexing."""
+        self.submit(self.add_chat, text)
+
+    def load(self):
+        """Rebuild the trie from the persisted counts."""
+        if not path.exists(COMPLETION_INDEX_PATH):
+            return
+        with open(COMPLETION_INDEX_PATH, 'r') as f:
+            state = json.load(f)
+        self.files = state.get("files", {})
+        self.chat_words = state.get("chats", {})
+        for counts in [self.chat_words] + [entry["words"] for entry in self.files.values()]:
+            for word, count in counts.items():
+                self.adjust(word, count)
+
+    def scan_library(self):
+        """Re-index library files that are new, changed or deleted since the index was saved."""
+        for filename in listdir('.'):
+            if filename.endswith('.txt') and path.isfile(filename):
+                entry = self.files.get(filename)
+                if entry is None or entry["mtime"] != path.getmtime(filename):
+                    self.update_file(filename)
+        for filename in list(self.files):
+            if not path.exists(filename):
+                self.update_file(filename)
+
+    def save(self):
+        temp_path = COMPLETION_INDEX_PATH + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({"files": self.files, "chats": self.chat_words}, f)
+        os.replace(temp_path, COMPLETION_INDEX_PATH)
+        self.dirty = False
+
+    def load_and_scan(self):
+        """Load and refresh the index, then apply the updates queued meanwhile."""
+        try:
+            self.load()
+        except Exception as e:
+            self.root, self.files, self.chat_words = TrieNode(), {}, {}  # Unreadable index; rebuild it
+        try:
+            self.scan_library()
+        except Exception as e:
+            pass  # Completion still works from whatever was indexed
+        self.apply_pending()
+
+    def apply_pending(self):
+        """Apply queued updates until none are left, saving the index once they stop."""
+        while True:
+            with self.condition:
+                task = self.pending.popleft() if self.pending else None
+                if task is None and not self.dirty:
+                    self.scheduled = False
+                    return
+            if task is None:
+                try:
+                    self.save()
+                except Exception as e:
+                    self.dirty = False  # Not persisted this time; retried after the next update
+                continue
+            function, args = task
+            try:
+                function(*args)
+            except Exception as e:
+                pass  # A bad update must not stop the index
+
+
+def count_words(text):
+    """Count the lower-cased words in text that are long enough to complete."""
+    counts = {}
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group().lower()
+        if len(word) >= COMPLETION_MIN_WORD_LENGTH:
+            counts[word] = counts.get(word, 0) + 1
+    return counts
+
+
+def trailing_word(text):
+    """Return the word being typed at the end of text, or '' if text ends in a space or punctuation."""
+    start = len(text)
+    while start > 0 and (text[start - 1].isalpha() or text[start - 1] == "'"):
+        start -= 1
+    return text[start:].lstrip("'")
+
+
+# Shared by the word processor and AlphaChat
+completion_index = CompletionIndex()
@@ -0,0 +1,326 @@
+"""
+Keyboard input, shared by gfxhat.py and 128x32oled.py: the curses backend,
+python-evdev reading /dev/input directly when it is installed and configured,
+and the TextInput prompt.
+"""
+import curses
+import os
+import select
+import signal
+import threading
+import time
+from collections import deque
+
+try:
+    import evdev
+    from evdev import ecodes
+except ImportError:
+    evdev = None  # Raw keyboard input is optional; curses is used without it
+
+ESCAPE = 27
+ENTER_KEYS = [10, 13, curses.KEY_ENTER]
+INPUT_REPEAT_DELAY = 0.4  # Seconds a key is held before the evdev backend starts repeating it
+INPUT_REPEAT_INTERVAL = 0.05  # Seconds between evdev autorepeats
+INPUT_QUEUE_LIMIT = 256  # Evdev key events buffered before the oldest are dropped
+
+
+class CursesInput:
+    """Reads keys from the terminal through curses. The default backend, and the fallback for evdev."""
+
+    name = "curses"
+
+    def __init__(self):
+        self.last_key_time = None  # When the last returned key arrived, for key-to-frame latency
+
+    def getch(self, stdscr):
+        key = stdscr.getch()
+        if key != curses.ERR:
+            self.last_key_time = time.time()
+        return key
+
+    def set_timeout(self, stdscr, milliseconds):
+        """Like stdscr.timeout(): 0 never waits, -1 waits for a key."""
+        stdscr.timeout(milliseconds)
+
+    def close(self):
+        pass
+
+
+def evdev_keymap():
+    """Map evdev key codes to their (unshifted, shifted) characters on a US layout."""
+    keymap = {getattr(ecodes, 'KEY_' + letter): (letter.lower(), letter) for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"}
+    for digit, shifted in zip("1234567890", "!@#$%^&*()"):
+        keymap[getattr(ecodes, 'KEY_' + digit)] = (digit, shifted)
+    keymap.update({
+        ecodes.KEY_SPACE: (' ', ' '),
+        ecodes.KEY_MINUS: ('-', '_'),
+        ecodes.KEY_EQUAL: ('=', '+'),
+        ecodes.KEY_LEFTBRACE: ('[', '{'),
+        ecodes.KEY_RIGHTBRACE: (']', '}'),
+        ecodes.KEY_SEMICOLON: (';', ':'),
+        ecodes.KEY_APOSTROPHE: ("'", '"'),
+        ecodes.KEY_GRAVE: ('`', '~'),
+        ecodes.KEY_BACKSLASH: ('\\', '|'),
+        ecodes.KEY_COMMA: (',', '<'),
+        ecodes.KEY_DOT: ('.', '>'),
+        ecodes.KEY_SLASH: ('/', '?'),
+    })
+    return keymap
+
+
+class EvdevInput(CursesInput):
+    """
+    Reads keyboards straight from /dev/input/event* with python-evdev, bypassing
+    the tty line discipline and curses. The devices are grabbed so the console does
+    not see the keys as well. A reader thread turns key events into the codes curses
+    would return (shift, caps lock and ctrl applied, arrows as curses.KEY_*), each
+    stamped with the kernel time of the press, and generates autorepeat itself from
+    the held keys. If every device goes away, input falls back to curses.
+    devices lists event device paths to use (e.g. a uinput test keyboard);
+    by default every device with letter keys is used.
+    """
+
+    name = "evdev"
+
+    def __init__(self, devices=None):
+        super().__init__()
+        self.devices = {}  # fd -> InputDevice
+        for device_path in devices or evdev.list_devices():
+            try:
+                device = evdev.InputDevice(device_path)
+            except OSError as e:
+                continue  # Unreadable (not in the input group?) or gone
+            try:
+                if not devices and ecodes.KEY_A not in device.capabilities().get(ecodes.EV_KEY, []):
+                    raise OSError("not a keyboard")  # Power button, touch controller...
+                device.grab()
+                self.devices[device.fd] = device
+            except OSError as e:
+                device.close()  # Not a keyboard, or already grabbed by another process
+        if not self.devices:
+            raise OSError("No keyboard found under /dev/input")
+        self.keymap = evdev_keymap()
+        self.special = {
+            ecodes.KEY_ENTER: 10,
+            ecodes.KEY_KPENTER: 10,
+            ecodes.KEY_BACKSPACE: 127,
+            ecodes.KEY_ESC: ESCAPE,
+            ecodes.KEY_TAB: 9,
+            ecodes.KEY_UP: curses.KEY_UP,
+            ecodes.KEY_DOWN: curses.KEY_DOWN,
+            ecodes.KEY_LEFT: curses.KEY_LEFT,
+            ecodes.KEY_RIGHT: curses.KEY_RIGHT,
+            ecodes.KEY_HOME: curses.KEY_HOME,
+            ecodes.KEY_END: curses.KEY_END,
+            ecodes.KEY_DELETE: curses.KEY_DC,
+        }
+        self.shift_keys = {ecodes.KEY_LEFTSHIFT, ecodes.KEY_RIGHTSHIFT}
+        self.ctrl_keys = {ecodes.KEY_LEFTCTRL, ecodes.KEY_RIGHTCTRL}
+        self.held = set()  # Key codes currently down
+        self.caps_lock = False
+        self.repeat = None  # (key code, translated key) of the key being autorepeated
+        self.repeat_at = 0.0
+        self.events = deque(maxlen=INPUT_QUEUE_LIMIT)  # (key, timestamp) not yet read
+        self.condition = threading.Condition()
+        self.timeout = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="evdev-input", daemon=True)
+        self.thread.start()
+
+    def is_held(self, code):
+        """Whether the evdev key code (e.g. ecodes.KEY_LEFTSHIFT) is currently down."""
+        return code in self.held
+
+    def translate(self, code):
+        """Turn a pressed key code into a curses key code, or None for keys that type nothing."""
+        if code in self.special:
+            return self.special[code]
+        chars = self.keymap.get(code)
+        if chars is None:
+            return None
+        char = chars[1] if self.held & self.shift_keys else chars[0]
+        if self.caps_lock and char.isalpha():
+            char = char.swapcase()
+        if self.held & self.ctrl_keys:
+            if not char.isalpha():
+                return None
+            if char.lower() == 'c':
+                # The tty no longer sees the keyboard, so deliver its Ctrl-C ourselves
+                os.kill(os.getpid(), signal.SIGINT)
+                return None
+            return ord(char.lower()) & 0x1f
+        return ord(char)
+
+    def handle_key(self, code, value, timestamp):
+        """Apply one EV_KEY event: value 1 is a press, 0 a release, 2 the kernel's autorepeat."""
+        if value == 2:
+            return  # Repeats are generated from self.held, at INPUT_REPEAT_DELAY/INTERVAL
+        if value == 0:
+            self.held.discard(code)
+            if self.repeat and self.repeat[0] == code:
+                self.repeat = None
+            return
+        self.held.add(code)
+        if code == ecodes.KEY_CAPSLOCK:
+            self.caps_lock = not self.caps_lock
+        key = self.translate(code)
+        if key is not None:
+            self.push(key, timestamp)
+            self.repeat = (code, key)
+            self.repeat_at = time.time() + INPUT_REPEAT_DELAY
+
+    def push(self, key, timestamp):
+        with self.condition:
+            self.events.append((key, timestamp))
+            self.condition.notify_all()
+
+    def run(self):
+        """Reader thread: wait for key events on every device and for the next autorepeat."""
+        while self.running and self.devices:
+            timeout = None if self.repeat is None else max(self.repeat_at - time.time(), 0)
+            try:
+                readable = select.select(list(self.devices), [], [], timeout)[0]
+            except (OSError, ValueError) as e:
+                readable = list(self.devices)  # Let the reads below find the broken device
+            for fd in readable:
+                device = self.devices[fd]
+                try:
+                    for event in device.read():
+                        if event.type == ecodes.EV_KEY:
+                            self.handle_key(event.code, event.value, event.timestamp())
+                except BlockingIOError as e:
+                    pass  # Woken without a complete event
+                except OSError as e:
+                    # Unplugged: forget its keys so nothing keeps repeating
+                    del self.devices[fd]
+                    self.held.clear()
+                    self.repeat = None
+            now = time.time()
+            if self.repeat is not None and now >= self.repeat_at:
+                self.push(self.repeat[1], now)
+                self.repeat_at = now + INPUT_REPEAT_INTERVAL
+        with self.condition:
+            self.condition.notify_all()  # Release a blocked getch so it falls back to curses
+
+    def getch(self, stdscr):
+        if not self.devices:
+            return super().getch(stdscr)
+        with self.condition:
+            if not self.events and self.timeout:
+                self.condition.wait(None if self.timeout < 0 else self.timeout / 1000)
+            if not self.events:
+                return curses.ERR
+            key, self.last_key_time = self.events.popleft()
+        return key
+
+    def set_timeout(self, stdscr, milliseconds):
+        self.timeout = milliseconds
+        stdscr.timeout(milliseconds)  # Used by the curses fallback
+
+    def close(self):
+        """Stop reading and hand the keyboards back to the console."""
+        self.running = False
+        for device in list(self.devices.values()):
+            try:
+                device.ungrab()
+                device.close()
+            except OSError as e:
+                pass
+
+
+class TextInput:
+    """
+    Text entry used by every prompt. It redraws only when the text or cursor
+    changes and otherwise waits for keys. Left/Right, Up/Down (a line at a time)
+    and Home/End move the cursor; Backspace and Delete edit around it. mask shows
+    '*' for each character, for keys and passwords. Keys that arrive together, as
+    when text is pasted into the terminal, are applied as one edit and one redraw;
+    line breaks inside such a burst are dropped rather than submitting.
+    chars_per_line and rows size the text area to the display, below the prompt line.
+    """
+
+    def __init__(self, prompt, chars_per_line, rows, max_length=42, mask=False, text=""):
+        self.prompt = prompt
+        self.chars_per_line = chars_per_line
+        self.rows = rows
+        self.max_length = max_length
+        self.mask = mask
+        self.text = text[:max_length]
+        self.cursor = len(self.text)
+        self.first_line = 0  # First visible line of the wrapped text
+
+    def insert(self, chars):
+        """Insert at the cursor, up to max_length."""
+        chars = chars[:self.max_length - len(self.text)]
+        self.text = self.text[:self.cursor] + chars + self.text[self.cursor:]
+        self.cursor += len(chars)
+
+    def handle_key(self, key):
+        """Apply one key. Returns "submit" or "cancel" when the prompt should end, else None."""
+        if key in ENTER_KEYS:
+            return "submit" if self.text else None
+        elif key == ESCAPE:
+            return "cancel"
+        elif key in (curses.KEY_BACKSPACE, 127, 8):
+            if self.cursor:
+                self.text = self.text[:self.cursor - 1] + self.text[self.cursor:]
+                self.cursor -= 1
+        elif key == curses.KEY_DC:
+            self.text = self.text[:self.cursor] + self.text[self.cursor + 1:]
+        elif key == curses.KEY_LEFT:
+            self.cursor = max(self.cursor - 1, 0)
+        elif key == curses.KEY_RIGHT:
+            self.cursor = min(self.cursor + 1, len(self.text))
+        elif key == curses.KEY_UP:
+            self.cursor = max(self.cursor - self.chars_per_line, 0)
+        elif key == curses.KEY_DOWN:
+            self.cursor = min(self.cursor + self.chars_per_line, len(self.text))
+        elif key == curses.KEY_HOME:
+            self.cursor = 0
+        elif key == curses.KEY_END:
+            self.cursor = len(self.text)
+        elif 32 <= key <= 126:
+            self.insert(chr(key))
+        return None
+
+    def frame(self):
+        """Frame description: the prompt, then the text broken into lines with the cursor underlined."""
+        shown = ('*' * len(self.text) if self.mask else self.text) + ' '  # Room for the cursor at the end
+        lines = [shown[start:start + self.chars_per_line] for start in range(0, len(shown), self.chars_per_line)]
+        rows = self.rows
+        cursor_line, column = divmod(self.cursor, self.chars_per_line)
+        self.first_line = min(max(self.first_line, cursor_line - rows + 1), cursor_line)
+        visible_lines = lines[self.first_line:self.first_line + rows]
+        cursor = (cursor_line - self.first_line + 1, column, column + 1)
+        return ("lines", (self.prompt,) + tuple(visible_lines), (cursor,), "")
+
+    def run(self, stdscr, renderer, keys, poll_interval):
+        """
+        Edit until Enter, returning the text, or Escape, returning None.
+        Frames go to renderer; keys (the IdleManager) is polled every poll_interval seconds.
+        """
+        frame = None
+        while True:
+            if frame is None:
+                frame = self.frame()
+            if frame != renderer.last_frame:
+                renderer.submit(frame)  # Also redraws the prompt after a message from another screen
+
+            key = keys.wait_key(stdscr, poll_interval)
+            if key == curses.ERR:
+                continue
+            keys = [key]
+            while True:
+                key = keys.read_key(stdscr)  # Rest of a paste, if any
+                if key == curses.ERR:
+                    break
+                keys.append(key)
+            for idx, key in enumerate(keys):
+                if key in ENTER_KEYS and idx < len(keys) - 1:
+                    continue  # A line break inside pasted text
+                result = self.handle_key(key)
+                if result == "submit":
+                    return self.text
+                if result == "cancel":
+                    return None
+            frame = None
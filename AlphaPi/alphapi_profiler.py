@@ -0,0 +1,82 @@
+"""
+On-demand sampling profiler, shared by gfxhat.py and 128x32oled.py.
+"""
+import signal
+import sys
+import threading
+import time
+from os import path
+
+PROFILER_INTERVAL = 0.01  # Seconds of CPU time between profiler samples
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler that can be switched on in the field.
+    While running, SIGPROF fires every PROFILER_INTERVAL seconds of process CPU
+    time and the handler records the Python stack of every thread (the main loop,
+    the chat stream, the render thread...). Stopping writes the samples in
+    collapsed-stack format ("thread;outer;...;inner count" per line), which
+    flamegraph.pl and speedscope read directly, into profile_dir.
+    """
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.counts = {}  # (thread ident, code objects outermost first) -> samples
+        self.running = False
+        self.started_at = None
+
+    def toggle(self):
+        """Start or stop profiling and return a short status message."""
+        if not self.running:
+            self.start()
+            return "Profiling..."
+        profile_path = self.stop()
+        return f"Saved {path.basename(profile_path)}" if profile_path else "Profile not saved."
+
+    def start(self):
+        self.counts = {}
+        self.started_at = time.time()
+        self.running = True
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, PROFILER_INTERVAL, PROFILER_INTERVAL)
+
+    def stop(self):
+        """Stop sampling and write the profile. Returns its path, or None if it could not be written."""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+        try:
+            return self.write()
+        except Exception as e:
+            return None
+
+    def sample(self, signum, frame):
+        """SIGPROF handler; runs on the main thread between bytecodes, so it only reads frames."""
+        main_ident = threading.main_thread().ident
+        for ident, top in sys._current_frames().items():
+            if ident == main_ident:
+                top = frame  # Leave out this handler's own frame
+            codes = []
+            while top is not None:
+                codes.append(top.f_code)
+                top = top.f_back
+            key = (ident, tuple(reversed(codes)))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def write(self):
+        """Write the samples as collapsed stacks, heaviest first, and return the file path."""
+        # Thread names are looked up now rather than in the signal handler, which must not take locks
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        collapsed = {}
+        for (ident, codes), count in self.counts.items():
+            frames = [names.get(ident, f"thread-{ident}")]
+            frames += [f"{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})" for code in codes]
+            line = ';'.join(frame.replace(';', ':') for frame in frames)
+            collapsed[line] = collapsed.get(line, 0) + count
+        profile_path = path.join(self.profile_dir, time.strftime(
+            "alphapi_profile_%Y%m%d-%H%M%S.collapsed", time.localtime(self.started_at)))
+        with open(profile_path, 'w') as f:
+            for line, count in sorted(collapsed.items(), key=lambda item: -item[1]):
+                f.write(f"{line} {count}\n")
+        return profile_path
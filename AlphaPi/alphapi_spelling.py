@@ -0,0 +1,220 @@
+"""
+Background spell checking against a Bloom filter dictionary, shared by gfxhat.py and 128x32oled.py.
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import deque
+from os import path
+
+from alphapi_tasks import PRIORITY_RENDER, PRIORITY_INDEXING, scheduler
+
+SPELL_WORDLIST_PATH = '/usr/share/dict/words'  # Word list the spelling dictionary is built from
+SPELL_DICTIONARY_PATH = '/home/ninjinka/alphapi_dictionary.bloom'  # Compiled Bloom filter dictionary
+SPELL_BITS_PER_WORD = 24  # With SPELL_HASH_COUNT hashes this gives about 0.001% false positives
+SPELL_HASH_COUNT = 16  # Suggestion search probes thousands of candidates, so false positives must be rare
+SPELL_MAGIC = b'APBF'
+SPELL_HEADER = struct.Struct('<4sII')  # magic, bit count, hash count
+SPELL_SUGGESTION_LIMIT = 5
+SPELL_MAX_EDIT_DISTANCE = 2
+SPELL_CANDIDATE_LIMIT = 20000  # Upper bound on candidates tried when searching for suggestions
+WORD_PATTERN = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)*")
+
+
+def bloom_positions(word, bit_count, hash_count):
+    """Return the Bloom filter bit positions for a word (double hashing of crc32 and adler32)."""
+    data = word.encode('utf-8')
+    h1 = zlib.crc32(data)
+    h2 = zlib.adler32(data) | 1
+    return [(h1 + i * h2) % bit_count for i in range(hash_count)]
+
+
+def build_spell_dictionary(wordlist_path, dictionary_path):
+    """Compile a word list (one word per line) into a Bloom filter file for SpellChecker."""
+    with open(wordlist_path, 'r', errors='ignore') as f:
+        words = {line.strip().lower() for line in f if line.strip()}
+    bit_count = max(len(words) * SPELL_BITS_PER_WORD, 8)
+    bits = bytearray((bit_count + 7) // 8)
+    for word in words:
+        for position in bloom_positions(word, bit_count, SPELL_HASH_COUNT):
+            bits[position >> 3] |= 1 << (position & 7)
+    temp_path = dictionary_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SPELL_HEADER.pack(SPELL_MAGIC, bit_count, SPELL_HASH_COUNT))
+        f.write(bits)
+    os.replace(temp_path, dictionary_path)
+
+
+class SpellChecker:
+    """
+    Background spell checker backed by a Bloom filter dictionary in a memory-mapped file,
+    so loading is instant and the dictionary costs about SPELL_BITS_PER_WORD bits per word.
+    The editor asks about words with misspelled(); words not seen before are looked up
+    on a worker thread and cached, so typing never waits on the dictionary. The first
+    use builds the dictionary from SPELL_WORDLIST_PATH if it does not exist yet.
+    """
+
+    def __init__(self):
+        self.filter = None  # mmap of the dictionary file
+        self.bit_count = 0
+        self.hash_count = 0
+        self.results = {}  # word -> True if spelled correctly
+        self.pending = deque()
+        self.queued = set()
+        self.condition = threading.Condition()
+        self.started = False
+        self.scheduled = False  # A job that checks pending words is queued or running
+
+    def start(self):
+        """Load the dictionary on the scheduler; that job then checks any words queued meanwhile."""
+        with self.condition:
+            if self.started:
+                return
+            self.started = self.scheduled = True
+        scheduler.submit(PRIORITY_INDEXING, self.load_and_check, name="spell-dictionary")
+
+    def schedule(self):
+        """Queue a job to check the pending words, unless one is queued or running."""
+        with self.condition:
+            if self.scheduled or not self.pending:
+                return
+            self.scheduled = True
+        # Their underlines are drawn in the next frame, so lookups go ahead of everything else
+        scheduler.submit(PRIORITY_RENDER, self.check_pending, name="spell-check")
+
+    def load(self):
+        """Map the dictionary file, building it first if only the word list exists."""
+        if not path.exists(SPELL_DICTIONARY_PATH):
+            if not path.exists(SPELL_WORDLIST_PATH):
+                return
+            build_spell_dictionary(SPELL_WORDLIST_PATH, SPELL_DICTIONARY_PATH)
+        with open(SPELL_DICTIONARY_PATH, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, bit_count, hash_count = SPELL_HEADER.unpack_from(mapped)
+        if magic == SPELL_MAGIC:
+            self.bit_count, self.hash_count = bit_count, hash_count
+            self.filter = mapped
+
+    def contains(self, word):
+        """Return True if the (lower-case) word is probably in the dictionary."""
+        base = SPELL_HEADER.size
+        return all(self.filter[base + (position >> 3)] & (1 << (position & 7))
+                   for position in bloom_positions(word, self.bit_count, self.hash_count))
+
+    def is_correct(self, word):
+        word = word.lower()
+        if self.contains(word):
+            return True
+        # Accept possessives of known words
+        return word.endswith("'s") and self.contains(word[:-2])
+
+    def misspelled(self, word):
+        """
+        Returns True if the word is known to be misspelled. Unchecked words are
+        queued for the worker and reported as correct until it gets to them.
+        """
+        result = self.results.get(word)
+        if result is None:
+            self.start()
+            with self.condition:
+                if word not in self.queued:
+                    self.queued.add(word)
+                    self.pending.append(word)
+            self.schedule()
+            return False
+        return not result
+
+    def load_and_check(self):
+        """Load the dictionary, then check the words queued while it loaded."""
+        try:
+            self.load()
+        except Exception as e:
+            pass  # No usable dictionary; every word is reported as correct
+        self.check_pending()
+
+    def check_pending(self):
+        """Check queued words until none are left. Only one such job runs at a time."""
+        while True:
+            with self.condition:
+                if not self.pending:
+                    self.scheduled = False
+                    return
+                word = self.pending.popleft()
+                self.queued.discard(word)
+            self.results[word] = self.filter is None or self.is_correct(word)
+
+    def suggestions(self, word):
+        """
+        Returns up to SPELL_SUGGESTION_LIMIT dictionary words within edit distance
+        SPELL_MAX_EDIT_DISTANCE of word, closest first. Candidate generation is capped
+        at SPELL_CANDIDATE_LIMIT, but a long word can still take a few hundred
+        milliseconds, so callers run this as a scheduler task rather than on the UI thread.
+        """
+        if self.filter is None:
+            return []
+        lower = word.lower()
+        found = []
+        frontier = {lower}
+        seen = {lower}
+        for distance in range(SPELL_MAX_EDIT_DISTANCE):
+            next_frontier = set()
+            for current in frontier:
+                for candidate in single_edits(current):
+                    if candidate in seen or len(seen) >= SPELL_CANDIDATE_LIMIT:
+                        continue
+                    seen.add(candidate)
+                    next_frontier.add(candidate)
+                    if candidate and self.contains(candidate):
+                        found.append(candidate)
+                        if len(found) >= SPELL_SUGGESTION_LIMIT:
+                            return [match_case(word, match) for match in found]
+            if found:
+                break  # Closer suggestions beat more distant ones
+            frontier = next_frontier
+        return [match_case(word, match) for match in found]
+
+
+def single_edits(word):
+    """All strings one delete, transpose, replace or insert away from word."""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    for left, right in splits:
+        if right:
+            yield left + right[1:]
+        if len(right) > 1:
+            yield left + right[1] + right[0] + right[2:]
+        for letter in letters:
+            if right:
+                yield left + letter + right[1:]
+            yield left + letter + right
+
+
+def match_case(original, suggestion):
+    """Give a suggestion the capitalization of the word it replaces."""
+    if original.isupper():
+        return suggestion.upper()
+    if original[:1].isupper():
+        return suggestion.capitalize()
+    return suggestion
+
+
+def misspelled_spans(lines, skip_last_word=False):
+    """
+    Returns (line index, start, end) character spans of misspelled words in lines.
+    skip_last_word leaves out the final word while it is still being typed.
+    """
+    spans = []
+    for idx, line in enumerate(lines):
+        for match in WORD_PATTERN.finditer(line):
+            if skip_last_word and idx == len(lines) - 1 and match.end() == len(line):
+                continue
+            if len(match.group()) > 1 and spell_checker.misspelled(match.group()):
+                spans.append((idx, match.start(), match.end()))
+    return tuple(spans)
+
+
+# Shared by every open document so checked words are cached once
+spell_checker = SpellChecker()
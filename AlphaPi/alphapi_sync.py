@@ -0,0 +1,89 @@
+"""
+Incremental sync of the document library to another directory, shared by gfxhat.py and 128x32oled.py.
+"""
+import hashlib
+import json
+import os
+
+SYNC_MANIFEST_NAME = '.alphapi_sync.json'  # Manifest kept in the sync target directory
+SYNC_CHUNK_SIZE = 64 * 1024  # Bytes read at a time when hashing or copying during sync
+
+
+def file_sha256(file_path):
+    """Hash a file in SYNC_CHUNK_SIZE chunks so large files never load into memory at once."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(SYNC_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file_atomic(source_path, target_path):
+    """Stream a file to a temporary name next to the target, then rename it into place."""
+    temp_path = target_path + '.part'
+    with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(SYNC_CHUNK_SIZE), b''):
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(temp_path, target_path)
+
+
+def sync_library(source_dir, target_dir, progress=None):
+    """
+    Mirrors the .txt files in source_dir to target_dir.
+    A manifest in the target records the size, mtime and SHA-256 of each synced file:
+    files whose size and mtime are unchanged are skipped on a stat alone, and changed
+    files are only copied if their hash differs. Files the manifest owns that are no
+    longer in source_dir (deleted or renamed) are deleted from the target, unless the
+    target copy was changed since it was synced. Returns (copied, unchanged, deleted) counts.
+    """
+    manifest_path = os.path.join(target_dir, SYNC_MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except Exception as e:
+        manifest = {}
+
+    target_names = {entry.name for entry in os.scandir(target_dir)}
+    sources = [entry for entry in os.scandir(source_dir) if entry.is_file() and entry.name.endswith('.txt')]
+    new_manifest = {}
+    copied = unchanged = 0
+    for index, entry in enumerate(sources):
+        stat = entry.stat()
+        known = manifest.get(entry.name)
+        record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if (known and entry.name in target_names and known["size"] == stat.st_size
+                and known["mtime_ns"] == stat.st_mtime_ns):
+            new_manifest[entry.name] = known
+            unchanged += 1
+            continue
+
+        record["sha256"] = file_sha256(entry.path)
+        if known and entry.name in target_names and known.get("sha256") == record["sha256"]:
+            unchanged += 1  # Touched but identical, only the manifest needs updating
+        else:
+            if progress:
+                progress(index + 1, len(sources), entry.name)
+            copy_file_atomic(entry.path, os.path.join(target_dir, entry.name))
+            copied += 1
+        new_manifest[entry.name] = record
+
+    deleted = 0
+    for name, known in manifest.items():
+        if name in new_manifest or name not in target_names:
+            continue
+        target_path = os.path.join(target_dir, name)
+        try:
+            if file_sha256(target_path) == known.get("sha256"):
+                os.remove(target_path)
+                deleted += 1
+        except OSError as e:
+            pass  # Gone already or unreadable; it is dropped from the manifest either way
+
+    if new_manifest != manifest:
+        temp_path = manifest_path + '.part'
+        with open(temp_path, 'w') as f:
+            json.dump(new_manifest, f)
+        os.replace(temp_path, manifest_path)
+    return copied, unchanged, deleted
@@ -0,0 +1,157 @@
+"""
+Background task scheduler shared by gfxhat.py and 128x32oled.py.
+
+Every background job (saves, chat streams, Wi-Fi, indexing...) runs on one fixed
+pool of worker threads. Jobs are queued in priority classes, most urgent first;
+class limits keep long network and indexing jobs from taking every worker.
+"""
+import os
+import threading
+from collections import deque
+
+# Background task priority classes, most urgent first
+PRIORITY_RENDER = 0  # Work whose result is drawn in the next frame
+PRIORITY_INPUT = 1  # Work a key or button press is waiting on
+PRIORITY_SAVE = 2
+PRIORITY_NETWORK = 3
+PRIORITY_INDEXING = 4
+PRIORITY_NAMES = ("render", "input", "save", "network", "indexing")
+NETWORK_WORKERS = 6  # Network jobs run at once, so every open chat can stream its answer
+# Fixed number of background worker threads: every network job, indexing and one more
+SCHEDULER_THREADS = NETWORK_WORKERS + 2
+# Most workers each class may hold at once, so long network and indexing jobs always leave one free;
+# saves run one at a time, so snapshots of a document are written in the order they were taken
+SCHEDULER_CLASS_LIMITS = {PRIORITY_SAVE: 1, PRIORITY_NETWORK: NETWORK_WORKERS, PRIORITY_INDEXING: 1}
+SCHEDULER_NICE = 5  # Workers run this much nicer than the UI and render threads
+SCHEDULER_FAILURE_HISTORY = 8  # Failed tasks listed by the task status screen
+
+
+class Task:
+    """
+    A job submitted to the scheduler. state is "queued", "running", "done"
+    (result holds what the function returned), "failed" (error holds the
+    exception text) or "cancelled".
+    """
+
+    def __init__(self, priority, name, function, args):
+        self.priority = priority
+        self.name = name
+        self.function = function
+        self.args = args
+        self.state = "queued"
+        self.error = None
+        self.result = None
+        self.cancelled = threading.Event()  # Set by cancel(); long jobs may check it to stop early
+        self.finished = threading.Event()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until the task has finished or been cancelled. Returns False on timeout."""
+        return self.finished.wait(timeout)
+
+    def cancel(self):
+        """Drop the task if it is still queued, or ask it to stop if it is running."""
+        scheduler.cancel(self)
+
+
+class TaskScheduler:
+    """
+    Runs background jobs (saves, chat streams, Wi-Fi, indexing...) on a fixed pool of
+    SCHEDULER_THREADS workers. Queued jobs start most urgent class first, from
+    PRIORITY_RENDER down to PRIORITY_INDEXING, in submission order within a class.
+    SCHEDULER_CLASS_LIMITS caps the long-running classes so a worker is always left
+    for saves and interactive work, and the workers run SCHEDULER_NICE below the
+    render thread, which never waits on the pool, so background work cannot delay a frame.
+    status() reports the workers, queues and running tasks.
+    """
+
+    def __init__(self, threads=SCHEDULER_THREADS):
+        self.condition = threading.Condition()
+        self.queues = [deque() for name in PRIORITY_NAMES]
+        self.running = [0] * len(PRIORITY_NAMES)
+        self.active = []  # Running tasks
+        self.failed = deque(maxlen=SCHEDULER_FAILURE_HISTORY)  # (name, error) of recent failures
+        self.threads = [threading.Thread(target=self.run, name=f"worker-{index}", daemon=True)
+                        for index in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, priority, function, *args, name=None):
+        """Queue function(*args) in a priority class and return its Task."""
+        task = Task(priority, name or function.__name__, function, args)
+        with self.condition:
+            self.queues[priority].append(task)
+            self.condition.notify()
+        return task
+
+    def cancel(self, task):
+        with self.condition:
+            task.cancelled.set()
+            if task.state == "queued":
+                self.queues[task.priority].remove(task)
+                task.state = "cancelled"
+                task.finished.set()
+                self.condition.notify_all()
+
+    def next_task(self):
+        """Pop the most urgent task whose class is under its limit. Called with the lock held."""
+        for priority, queue in enumerate(self.queues):
+            if queue and self.running[priority] < SCHEDULER_CLASS_LIMITS.get(priority, len(self.threads)):
+                return queue.popleft()
+        return None
+
+    def run(self):
+        """Worker loop: run the next task, at a lower CPU priority than the UI threads."""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(),
+                           min(os.getpriority(os.PRIO_PROCESS, 0) + SCHEDULER_NICE, 19))
+        except (AttributeError, OSError) as e:
+            pass  # Not supported here; the workers share the UI's priority
+        while True:
+            with self.condition:
+                task = self.next_task()
+                while task is None:
+                    self.condition.wait()
+                    task = self.next_task()
+                task.state = "running"
+                self.running[task.priority] += 1
+                self.active.append(task)
+            try:
+                task.result = task.function(*task.args)
+                state = "done"
+            except Exception as e:
+                state = "failed"
+                task.error = str(e)
+            with self.condition:
+                task.state = state
+                if state == "failed":
+                    self.failed.append((task.name, task.error))
+                self.running[task.priority] -= 1
+                self.active.remove(task)
+                task.finished.set()
+                self.condition.notify_all()  # A class limit may have freed up, and wait() may be done
+
+    def wait(self, priority=None, timeout=None):
+        """Wait until no task (of one class, if given) is queued or running. Returns False on timeout."""
+        priorities = range(len(self.queues)) if priority is None else [priority]
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not any(self.queues[p] or self.running[p] for p in priorities), timeout)
+
+    def status(self):
+        """Snapshot of the pool: worker counts, running and queued tasks per class, recent failures."""
+        with self.condition:
+            return {
+                "threads": len(self.threads),
+                "busy": len(self.active),
+                "classes": {name: {"running": self.running[priority], "queued": len(self.queues[priority])}
+                            for priority, name in enumerate(PRIORITY_NAMES)},
+                "running": [task.name for task in self.active],
+                "failed": list(self.failed),
+            }
+
+
+# Every background job runs here; only the render, display and input readers keep their own threads
+scheduler = TaskScheduler()
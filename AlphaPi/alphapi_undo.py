@@ -0,0 +1,119 @@
+"""
+Word-level undo/redo history for the word processor, shared by gfxhat.py and 128x32oled.py.
+"""
+import json
+import zlib
+from collections import deque
+
+UNDO_BYTE_BUDGET = 256 * 1024  # Approximate memory allowed for the word processor's undo history
+
+
+class UndoLog:
+    """
+    Memory-bounded undo/redo history for the word processor.
+    Edits are stored as [kind, position, text] groups, where kind is "insert" or
+    "delete" and position is an offset into the document. Consecutive keystrokes
+    are coalesced into word-sized groups, and the oldest groups are evicted once
+    the history grows past byte_budget.
+    """
+
+    GROUP_OVERHEAD = 64  # Approximate bytes used by a group besides its text
+
+    def __init__(self, byte_budget=UNDO_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.size = 0
+        self.sealed = False  # Set after undo/redo so the next edit starts a new group
+
+    def open_group(self, kind):
+        """Return the newest group if the next edit of this kind may extend it."""
+        if self.sealed or not self.undo_stack or self.undo_stack[-1][0] != kind:
+            return None
+        return self.undo_stack[-1]
+
+    def record_insert(self, position, text):
+        """Record text inserted at position, extending the current word group if possible."""
+        group = self.open_group("insert")
+        # A new group starts at the first character of each word
+        if (group and group[1] + len(group[2]) == position
+                and not (group[2][-1].isspace() and not text[0].isspace())):
+            group[2] += text
+            self.size += len(text)
+        else:
+            self.push(["insert", position, text])
+        self.after_edit()
+
+    def record_delete(self, position, text):
+        """Record text deleted at position, extending the current word group if possible."""
+        group = self.open_group("delete")
+        # Backspacing runs leftwards; a new group starts where whitespace precedes a word
+        if (group and position + len(text) == group[1]
+                and not (text[-1].isspace() and not group[2][0].isspace())):
+            group[1] = position
+            group[2] = text + group[2]
+            self.size += len(text)
+        else:
+            self.push(["delete", position, text])
+        self.after_edit()
+
+    def push(self, group):
+        self.undo_stack.append(group)
+        self.size += self.GROUP_OVERHEAD + len(group[2])
+
+    def after_edit(self):
+        """A new edit invalidates redo history and may push the log over budget."""
+        self.sealed = False
+        while self.redo_stack:
+            self.size -= self.GROUP_OVERHEAD + len(self.redo_stack.pop()[2])
+        while self.size > self.byte_budget and len(self.undo_stack) > 1:
+            self.size -= self.GROUP_OVERHEAD + len(self.undo_stack.popleft()[2])
+
+    def undo(self):
+        """Pop the newest group onto the redo stack and return it, or None if there is none."""
+        if not self.undo_stack:
+            return None
+        group = self.undo_stack.pop()
+        self.redo_stack.append(group)
+        self.sealed = True
+        return group
+
+    def redo(self):
+        """Pop the newest undone group back onto the undo stack and return it, or None."""
+        if not self.redo_stack:
+            return None
+        group = self.redo_stack.pop()
+        self.undo_stack.append(group)
+        self.sealed = True
+        return group
+
+    def snapshot(self, document):
+        """Return the log as JSON-ready data, tagged with a checksum of the saved text."""
+        return {
+            "crc": zlib.crc32(document.encode('utf-8')),
+            "undo": [list(group) for group in self.undo_stack],
+            "redo": [list(group) for group in self.redo_stack]
+        }
+
+    def load(self, log_path, document):
+        """Restore a saved log if it was written for exactly this document text."""
+        try:
+            with open(log_path, 'r') as f:
+                saved = json.load(f)
+            if saved.get("crc") != zlib.crc32(document.encode('utf-8')):
+                return  # The file changed outside the editor; the history no longer applies
+            self.undo_stack = deque(saved.get("undo", []))
+            self.redo_stack = deque(saved.get("redo", []))
+            self.size = sum(self.GROUP_OVERHEAD + len(group[2])
+                            for group in list(self.undo_stack) + list(self.redo_stack))
+            self.sealed = True
+        except Exception as e:
+            pass  # Missing or unreadable history, start fresh
+
+
+def apply_undo_group(document, group, reverse):
+    """Apply an undo group to the document text, or its inverse if reverse is True."""
+    kind, position, text = group
+    if (kind == "insert") != reverse:
+        return document[:position] + text + document[position:]
+    return document[:position] + document[position + len(text):]
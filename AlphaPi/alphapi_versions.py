@@ -0,0 +1,176 @@
+"""
+Delta-compressed version history of documents, shared by gfxhat.py and 128x32oled.py.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from os import path
+
+VERSION_HISTORY_SUFFIX = '.history'  # Version history is stored as <document><suffix>
+VERSION_KEYFRAME_INTERVAL = 20  # Every Nth saved version is stored in full
+VERSION_RETENTION = 200  # Number of saved versions kept per document
+
+
+def common_affix_lengths(old, new):
+    """Return the lengths of the common prefix and (non-overlapping) common suffix of two strings."""
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:  # Binary search keeps the comparisons in C
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+class VersionStore:
+    """
+    Append-only version history of a document, stored as <document><VERSION_HISTORY_SUFFIX>.
+    Every VERSION_KEYFRAME_INTERVAL versions a full keyframe is written; other versions
+    are deltas against the previous one (common prefix/suffix lengths plus the replaced
+    middle), so a save after typing a few words appends only a few dozen bytes.
+    Only about VERSION_RETENTION versions are kept.
+    """
+
+    HEADER = struct.Struct('<BIdII')  # kind, version, timestamp, crc32 of the text, payload length
+    DELTA_HEADER = struct.Struct('<II')  # prefix length, suffix length
+    KEYFRAME = 0
+    DELTA = 1
+
+    def __init__(self, filename):
+        self.history_path = filename + VERSION_HISTORY_SUFFIX
+        self.records = []  # (kind, version, timestamp, crc, payload), oldest first
+        self.latest_text = None
+        self.load()
+
+    def load(self):
+        """Read the record index from disk, ignoring a truncated final record."""
+        if not path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            return
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            kind, version, timestamp, crc, length = self.HEADER.unpack_from(data, offset)
+            offset += self.HEADER.size
+            if offset + length > len(data):
+                break
+            self.records.append((kind, version, timestamp, crc, data[offset:offset + length]))
+            offset += length
+        # Records before the first keyframe cannot be reconstructed
+        while self.records and self.records[0][0] != self.KEYFRAME:
+            self.records.pop(0)
+
+    def text_at(self, index):
+        """
+        Reconstruct the text of records[index] from the nearest earlier keyframe.
+        Raises ValueError if the result does not match the crc32 stored with the record.
+        """
+        start = index
+        while self.records[start][0] != self.KEYFRAME:
+            start -= 1
+        text = zlib.decompress(self.records[start][4]).decode('utf-8')
+        for kind, version, timestamp, crc, payload in self.records[start + 1:index + 1]:
+            raw = zlib.decompress(payload)
+            prefix, suffix = self.DELTA_HEADER.unpack_from(raw)
+            middle = raw[self.DELTA_HEADER.size:].decode('utf-8')
+            text = text[:prefix] + middle + text[len(text) - suffix:]
+        if zlib.crc32(text.encode('utf-8')) != self.records[index][3]:
+            raise ValueError(f"Version {self.records[index][1]} is corrupt")
+        return text
+
+    def add(self, text):
+        """
+        Append a version if the text changed. Returns True if a record was written.
+        The record is kept in memory only once it is on disk, so a failed write
+        (which is raised) leaves the store as it was and the next save retries.
+        """
+        crc = zlib.crc32(text.encode('utf-8'))
+        if self.records and self.latest_text is None:
+            try:
+                self.latest_text = self.text_at(len(self.records) - 1)
+            except (ValueError, zlib.error, struct.error) as e:
+                self.latest_text = None  # Corrupt tail: start again from a keyframe
+        if self.latest_text == text:
+            return False  # Unchanged, nothing to write
+
+        version = self.records[-1][1] + 1 if self.records else 1
+        since_keyframe = 0
+        for record in reversed(self.records):
+            if record[0] == self.KEYFRAME:
+                break
+            since_keyframe += 1
+        kind, payload = self.KEYFRAME, zlib.compress(text.encode('utf-8'))
+        if self.latest_text is not None and since_keyframe + 1 < VERSION_KEYFRAME_INTERVAL:
+            prefix, suffix = common_affix_lengths(self.latest_text, text)
+            middle = text[prefix:len(text) - suffix].encode('utf-8')
+            delta = zlib.compress(self.DELTA_HEADER.pack(prefix, suffix) + middle)
+            if len(delta) < len(payload):
+                kind, payload = self.DELTA, delta
+
+        record = (kind, version, time.time(), crc, payload)
+        records = self.records + [record]
+        if len(records) > VERSION_RETENTION + VERSION_KEYFRAME_INTERVAL:
+            records = self.compact(records)
+        else:
+            self.append(record)
+        self.records = records
+        self.latest_text = text
+        return True
+
+    def append(self, record):
+        """Append one record to the file, truncating any partial write on failure."""
+        with open(self.history_path, 'ab') as f:
+            size = f.tell()
+            try:
+                f.write(self.encode(record))
+                f.flush()
+            except Exception as e:
+                f.truncate(size)  # A torn record would hide every later one from load()
+                raise
+
+    def compact(self, records):
+        """
+        Drop versions beyond VERSION_RETENTION (whole keyframe groups), rewrite the
+        file atomically and return the retained records.
+        """
+        cut = len(records) - VERSION_RETENTION
+        while cut > 0 and records[cut][0] != self.KEYFRAME:
+            cut -= 1  # Keep the keyframe the retained deltas depend on
+        records = records[cut:]
+        temp_path = self.history_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(self.encode(record) for record in records))
+        os.replace(temp_path, self.history_path)
+        return records
+
+    def encode(self, record):
+        kind, version, timestamp, crc, payload = record
+        return self.HEADER.pack(kind, version, timestamp, crc, len(payload)) + payload
+
+
+def get_version_store(filename):
+    """Return the cached VersionStore for filename. Callers must hold version_lock."""
+    store = version_stores.get(filename)
+    if store is None:
+        store = version_stores[filename] = VersionStore(filename)
+    return store
+
+
+# Version history per document; saves can run on background threads
+version_stores = {}
+version_lock = threading.Lock()
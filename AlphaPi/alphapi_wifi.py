@@ -0,0 +1,300 @@
+"""
+Wi-Fi scanning and connecting through nmcli or wpa_cli, shared by gfxhat.py and 128x32oled.py.
+"""
+import json
+import shutil
+import subprocess
+import threading
+import time
+
+from alphapi_tasks import PRIORITY_INPUT, scheduler
+
+WIFI_INTERFACE = 'wlan0'  # Interface used with wpa_cli when NetworkManager is not installed
+WIFI_SCAN_CACHE_FILE = '/home/ninjinka/alphapi_wifi_scan.json'  # Last scan, shown while a new one runs
+WIFI_COMMAND_TIMEOUT = 10.0  # Seconds allowed for a quick nmcli/wpa_cli command
+WIFI_SCAN_TIMEOUT = 20.0  # Seconds allowed for a full rescan
+WIFI_CONNECT_TIMEOUT = 45.0  # Seconds allowed for associating and getting an address
+WIFI_POLL_INTERVAL = 0.5  # Seconds between wpa_cli polls while scanning or connecting
+WIFI_SCAN_SETTLE = 4.0  # A wpa_cli scan is taken as finished once its results stop changing for this long
+
+
+class CommandRunner:
+    """
+    Runs the system tools WifiManager needs. A test can pass an object with the
+    same available() and run() methods that returns canned output instead.
+    """
+
+    def available(self, command):
+        """Return True if the command is installed."""
+        return shutil.which(command) is not None
+
+    def run(self, args, timeout=WIFI_COMMAND_TIMEOUT):
+        """Run a command and return (exit status, stdout). A missing or hung command returns (None, '')."""
+        try:
+            result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+            return result.returncode, result.stdout
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return None, ""
+
+
+def split_nmcli_fields(line):
+    """Split a line of nmcli terse (-t) output on unescaped colons."""
+    fields = []
+    current = []
+    escaped = False
+    for char in line:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == ':':
+            fields.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    fields.append(''.join(current))
+    return fields
+
+
+def parse_nmcli_networks(output):
+    """Parse `nmcli -t -f IN-USE,SSID,SIGNAL,SECURITY device wifi list` output into network dicts."""
+    networks = []
+    for line in output.splitlines():
+        fields = split_nmcli_fields(line)
+        if len(fields) < 4 or not fields[1]:
+            continue
+        networks.append({
+            "ssid": fields[1],
+            "signal": int(fields[2]) if fields[2].isdigit() else 0,
+            "secure": fields[3] not in ("", "--"),
+            "connected": fields[0] == "*",
+        })
+    return networks
+
+
+def parse_wpa_scan_results(output, connected_ssid=""):
+    """Parse `wpa_cli scan_results` output (bssid, frequency, dBm, flags, ssid per line) into network dicts."""
+    networks = []
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) < 5 or not fields[4]:
+            continue
+        try:
+            dbm = int(fields[2])
+        except ValueError:
+            continue
+        networks.append({
+            "ssid": fields[4],
+            "signal": max(0, min(100, 2 * (dbm + 100))),  # -100 dBm -> 0%, -50 dBm -> 100%
+            "secure": any(flag in fields[3] for flag in ("WPA", "WEP", "SAE")),
+            "connected": fields[4] == connected_ssid,
+        })
+    return networks
+
+
+class WifiManager:
+    """
+    Scans for and connects to Wi-Fi networks without blocking the UI.
+    Uses nmcli when NetworkManager is installed and wpa_cli otherwise, through a
+    CommandRunner. Scans and connections run on background threads; results are
+    merged into `networks` as they arrive and `version` is bumped so menus can redraw.
+    The last scan is cached to WIFI_SCAN_CACHE_FILE so the menu opens with it instantly.
+    """
+
+    def __init__(self, runner=None, cache_file=WIFI_SCAN_CACHE_FILE):
+        self.runner = runner or CommandRunner()
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.networks = []  # Strongest first, one entry per SSID
+        self.scanned_at = None  # time.time() of the last completed scan
+        self.version = 0
+        self.scanning = False
+        self.connecting = False
+        self.status = ""  # Result of the last connection attempt
+        self.tool = None
+        self.load_cache()
+
+    def detect_tool(self):
+        if self.tool is None:
+            if self.runner.available("nmcli"):
+                self.tool = "nmcli"
+            elif self.runner.available("wpa_cli"):
+                self.tool = "wpa_cli"
+        return self.tool
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+            self.networks = cache.get("networks", [])
+            self.scanned_at = cache.get("scanned_at")
+        except Exception as e:
+            pass  # No cached scan yet
+
+    def save_cache(self):
+        try:
+            with open(self.cache_file, 'w') as f:
+                json.dump({"networks": self.networks, "scanned_at": self.scanned_at}, f)
+        except Exception as e:
+            pass
+
+    def update(self, networks, complete=False):
+        """Merge scan results (strongest entry per SSID wins) and notify menus."""
+        best = {}
+        for network in networks:
+            current = best.get(network["ssid"])
+            if current is None or network["signal"] > current["signal"] or network["connected"]:
+                best[network["ssid"]] = dict(network, connected=network["connected"] or bool(current and current["connected"]))
+        with self.lock:
+            self.networks = sorted(best.values(), key=lambda n: (not n["connected"], -n["signal"]))
+            if complete:
+                self.scanned_at = time.time()
+            self.version += 1
+        if complete:
+            self.save_cache()
+
+    def scan_async(self):
+        """Start a background scan unless one is running."""
+        with self.lock:
+            if self.scanning:
+                return
+            self.scanning = True
+            self.version += 1
+        scheduler.submit(PRIORITY_INPUT, self.scan, name="wifi-scan")
+
+    def scan(self):
+        try:
+            tool = self.detect_tool()
+            if tool == "nmcli":
+                fields = ["nmcli", "-t", "-f", "IN-USE,SSID,SIGNAL,SECURITY", "device", "wifi", "list"]
+                # NetworkManager's own cached list first, then a fresh rescan
+                status, output = self.runner.run(fields + ["--rescan", "no"])
+                if status == 0:
+                    self.update(parse_nmcli_networks(output))
+                status, output = self.runner.run(fields + ["--rescan", "yes"], timeout=WIFI_SCAN_TIMEOUT)
+                if status == 0:
+                    self.update(parse_nmcli_networks(output), complete=True)
+            elif tool == "wpa_cli":
+                wpa = ["wpa_cli", "-i", WIFI_INTERFACE]
+                connected_ssid = self.wpa_connected_ssid()
+                self.runner.run(wpa + ["scan"])
+                # Results fill in over a few seconds; show them as they arrive
+                deadline = time.time() + WIFI_SCAN_TIMEOUT
+                previous = None
+                changed_at = time.time()
+                while time.time() < deadline and time.time() - changed_at < WIFI_SCAN_SETTLE:
+                    time.sleep(WIFI_POLL_INTERVAL)
+                    status, output = self.runner.run(wpa + ["scan_results"])
+                    if status == 0 and output != previous:
+                        self.update(parse_wpa_scan_results(output, connected_ssid))
+                        previous = output
+                        changed_at = time.time()
+                self.update(self.networks, complete=True)
+            else:
+                with self.lock:
+                    self.status = "No nmcli or wpa_cli."
+        finally:
+            with self.lock:
+                self.scanning = False
+                self.version += 1
+
+    def wpa_connected_ssid(self):
+        status, output = self.runner.run(["wpa_cli", "-i", WIFI_INTERFACE, "status"])
+        for line in output.splitlines() if status == 0 else []:
+            if line.startswith("ssid="):
+                return line[len("ssid="):]
+        return ""
+
+    def connect_async(self, ssid, password=None):
+        """Start connecting to a network in the background; progress is reported in status."""
+        with self.lock:
+            if self.connecting:
+                return
+            self.connecting = True
+            self.status = f"Connecting to {ssid}..."
+            self.version += 1
+        scheduler.submit(PRIORITY_INPUT, self.connect, ssid, password, name="wifi-connect")
+
+    def connect(self, ssid, password=None):
+        tool = None
+        message = f"Could not connect to {ssid}."
+        try:
+            tool = self.detect_tool()
+            if tool == "nmcli":
+                args = ["nmcli", "device", "wifi", "connect", ssid]
+                if password:
+                    args += ["password", password]
+                status, output = self.runner.run(args, timeout=WIFI_CONNECT_TIMEOUT)
+                ok = status == 0
+            elif tool == "wpa_cli":
+                ok = self.wpa_connect(ssid, password)
+            else:
+                ok = False
+            if ok:
+                message = f"Connected to {ssid}."
+                self.update([dict(n, connected=n["ssid"] == ssid) for n in self.networks])
+        finally:
+            with self.lock:
+                self.connecting = False
+                self.status = message if tool else "No nmcli or wpa_cli."
+                self.version += 1
+
+    def wpa_connect(self, ssid, password):
+        wpa = ["wpa_cli", "-i", WIFI_INTERFACE]
+        status, output = self.runner.run(wpa + ["add_network"])
+        network_id = output.strip().splitlines()[-1] if status == 0 and output.strip() else ""
+        if not network_id.isdigit():
+            return False
+        settings = [["ssid", json.dumps(ssid)]]
+        if password:
+            settings.append(["psk", json.dumps(password)])
+        else:
+            settings.append(["key_mgmt", "NONE"])
+        for name, value in settings:
+            status, output = self.runner.run(wpa + ["set_network", network_id, name, value])
+            if status != 0 or "FAIL" in output:
+                self.runner.run(wpa + ["remove_network", network_id])
+                return False
+        self.runner.run(wpa + ["select_network", network_id])
+        deadline = time.time() + WIFI_CONNECT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(WIFI_POLL_INTERVAL)
+            status, output = self.runner.run(wpa + ["status"])
+            if status == 0 and "wpa_state=COMPLETED" in output and self.wpa_connected_ssid() == ssid:
+                self.runner.run(wpa + ["save_config"])
+                return True
+        self.runner.run(wpa + ["remove_network", network_id])
+        return False
+
+    def menu_options(self):
+        """Return the current menu lines and the SSID each network line stands for."""
+        with self.lock:
+            networks = list(self.networks)
+            scanned_at = self.scanned_at
+            scanning = self.scanning
+            status = self.status
+        labels = {}
+        for network in networks:
+            label = f"{'*' if network['connected'] else ' '}{network['ssid']} {network['signal']}%"
+            labels.setdefault(label, network)
+        if scanning:
+            rescan = "Scanning..."
+        elif scanned_at is None:
+            rescan = "Scan"
+        else:
+            rescan = f"Rescan ({format_age(time.time() - scanned_at)} old)"
+        options = ([status] if status else []) + list(labels) + [rescan, "Back"]
+        return options, labels
+
+
+def format_age(seconds):
+    """Format an age in seconds as e.g. 40s, 5m or 2h."""
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    return f"{int(seconds // 3600)}h"
+
+
+wifi_manager = WifiManager()
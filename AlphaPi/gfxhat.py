@@ -4,7 +4,10 @@ import curses
 from os import listdir, path
 from openai import OpenAI
 import threading
+from array import array
+from collections import deque, OrderedDict
 import json
+import math
 import os
 import signal
 
@@ -14,7 +17,19 @@ library_dir = os.path.join(current_dir, '..', 'library')
 # Add 'library' to the Python path
 sys.path.append(os.path.abspath(library_dir))
 from gfxhat import lcd, backlight, fonts, touch
-from PIL import Image, ImageFont, ImageDraw
+from gfxhat.st7567 import ST7567_SETPAGESTART, ST7567_SETCOLL, ST7567_SETCOLH
+from alphapi_chat import ChunkChannel, chat_worker
+from alphapi_wifi import wifi_manager
+from alphapi_profiler import SamplingProfiler
+from alphapi_input import ESCAPE, ENTER_KEYS, CursesInput, EvdevInput, TextInput, evdev
+from alphapi_tasks import (NETWORK_WORKERS, PRIORITY_INPUT, PRIORITY_SAVE,
+                           PRIORITY_NETWORK, scheduler)
+from alphapi_undo import UndoLog, apply_undo_group
+from alphapi_versions import version_lock, get_version_store
+from alphapi_sync import sync_library
+from alphapi_spelling import WORD_PATTERN, misspelled_spans, spell_checker
+from alphapi_completion import completion_index, trailing_word
+from PIL import Image, ImageFont, ImageDraw, ImageChops
 
 # Constants
 DISPLAY_WIDTH = 128
@@ -23,11 +38,70 @@ SPLASH_IMAGE_PATH = '/home/ninjinka/piskel.png'
 FONT_PATH = fonts.Bitocra13Full  # Using Bitocra13Full font from gfxhat
 FONT_SIZE = 13
 MAX_FILENAME_LENGTH = 42  # Allow two lines of filename display
+MAX_URL_LENGTH = 128  # Longest server URL or sync path accepted by a prompt
+INPUT_CHARS_PER_LINE = 18  # Characters per line of a text prompt, as in wrap_text
 MAX_DISPLAY_LINES = 5      # Number of lines visible on GFX HAT (adjusted for 128x64 and font size)
 CONFIG_FILE = '/home/ninjinka/alphachat_config.json'  # Configuration file path
 MAX_TEXT_LENGTH = 50000  # Set a maximum text length to prevent excessive processing
 BUFFER_INTERVAL = 0.2  # 200 milliseconds
-shutdown_flag = threading.Event()
+METRICS_LOG_FILE = '/home/ninjinka/alphachat_metrics.jsonl'  # Per-request streaming telemetry log
+# Estimated USD price per 1M tokens (prompt, completion) for each selectable model
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+# OpenAI-compatible chat backends. Presets with "discover_models" list their models from /v1/models.
+# Each backend keeps its own "api_key", so a key entered for one server is never sent to another.
+DEFAULT_BACKEND = "OpenAI"
+BACKEND_PRESETS = {
+    "OpenAI": {
+        "base_url": "https://api.openai.com/v1",
+        "timeout": 60.0,
+        "models": ["gpt-4o-mini", "gpt-4o"],
+        "discover_models": False,
+        "needs_api_key": True,
+    },
+    "llama.cpp": {
+        "base_url": "http://localhost:8080/v1",
+        "timeout": 300.0,  # Local models on small hardware can take a while to answer
+        "models": [],
+        "discover_models": True,
+        "needs_api_key": False,
+    },
+    "Ollama": {
+        "base_url": "http://localhost:11434/v1",
+        "timeout": 300.0,
+        "models": [],
+        "discover_models": True,
+        "needs_api_key": False,
+    },
+}
+PROFILE_DIR = path.dirname(CONFIG_FILE)  # Profiles are written next to the config
+INPUT_LATENCY_WINDOW = 0.5  # A frame submitted later than this after a key is not counted as its response
+INPUT_LATENCY_SAMPLES = 512  # Key-to-frame latencies kept until they are logged
+MAX_CHAT_SESSIONS = NETWORK_WORKERS  # Open chats kept, one network worker each; the oldest idle ones are closed beyond this
+SAVE_FLUSH_TIMEOUT = 10.0  # Seconds to wait for pending saves when exiting
+SAVE_REPORT_TIMEOUT = 1.0  # Seconds leaving the editor waits for its save, to report a failure
+DOCUMENT_CHUNK_TOKENS = 2000  # Approximate tokens per chunk when asking about a document
+DOCUMENT_CHUNK_CHARS = DOCUMENT_CHUNK_TOKENS * 4  # ~4 characters per token
+DOCUMENT_MAX_PARALLEL = 8  # Chunk requests in flight at once; a 50k-character document needs one round
+DOCUMENT_MAP_PROMPT = ("You are reading part {part} of {parts} of a document. Extract only what in this part "
+                       "helps answer the question, as brief notes with key facts and short quotes. "
+                       "If nothing is relevant, reply 'Nothing relevant.'")
+MODEL_DISCOVERY_TIMEOUT = 5.0  # Seconds to wait for a backend's /v1/models listing
+IDLE_DIM_SECONDS = 60  # Default inactivity before dimming the panel (0 disables)
+IDLE_SLEEP_SECONDS = 180  # Default inactivity before powering the panel down (0 disables)
+IDLE_POLL_INTERVAL = 0.25  # Seconds between input polls while dimmed
+UNDO_LOG_SUFFIX = '.undo.json'  # Undo history is persisted as <document><suffix> when enabled
+MENU_FRAME_CACHE_SIZE = 64  # Rendered menu frames kept, one per menu and selection
+MAX_OPEN_DOCUMENTS = 8  # Documents kept open in the word processor before the oldest is closed
+RENDER_CACHE_BUDGET = 2 * 1024 * 1024  # Approximate bytes of wrap caches kept across open documents
+STREAM_FRAME_RATE = 8  # Default maximum redraws per second while an answer streams in (0 = unlimited)
+ACTIVITY_STRIP_WIDTH = 2  # Columns at the right edge, past the widest wrapped line, used by the activity indicator
+ACTIVITY_BAR_LENGTH = 6  # Height in pixels of the indicator's moving bar
+ACTIVITY_STEP_PIXELS = 2  # Distance the bar moves per step
+ACTIVITY_INTERVAL = 0.1  # Seconds between activity indicator steps
+IDLE_DIM_DIVISOR = 4  # Backlight is divided by this while dimmed
 
 # Initialize GFX HAT display
 lcd.clear()
@@ -36,6 +110,164 @@ lcd.contrast(40)
 backlight.set_all(0, 0, 0)
 backlight.show()
 
+
+# Reverses the bit order of a byte: PIL packs pixels MSB-first, the controllers want the top row in the LSB
+BIT_REVERSE = bytes(int('{:08b}'.format(value)[::-1], 2) for value in range(256))
+TRANSPOSE = getattr(Image, 'Transpose', Image).TRANSPOSE
+
+
+def pack_pages(frame):
+    """
+    Packs a mode '1' image into controller page bytes: one byte per column for each
+    8-row page, top row in the least significant bit, pages in order.
+    Transposing makes each display column one row of bytes, so the packing is
+    byte slicing and a translate table in C rather than a per-pixel Python loop.
+    """
+    width, height = frame.size
+    pages = height // 8
+    columns = frame.transpose(TRANSPOSE).tobytes()  # Row x holds column x, 8 pixels per byte
+    return b''.join(columns[page::pages] for page in range(pages)).translate(BIT_REVERSE)
+
+
+def find_lcd_page_driver():
+    """
+    Returns the ST7567 driver if writing pack_pages() output into its page buffer
+    gives exactly what lcd.set_image() produces for a test pattern, or None to keep
+    using the library's per-pixel set_image(). The driver is returned rather than
+    its buffer because lcd.clear() replaces the buffer with a new list.
+    """
+    driver = getattr(lcd, "st7567", None)
+    if getattr(driver, "buf", None) is None:
+        return None
+    test = Image.new('1', (DISPLAY_WIDTH, DISPLAY_HEIGHT))
+    test_draw = ImageDraw.Draw(test)
+    test_draw.line((0, 0, DISPLAY_WIDTH - 1, DISPLAY_HEIGHT // 2), fill=1)
+    test_draw.text((2, 2), "AlphaPi 0123", fill=1)
+    try:
+        lcd.set_image(test)
+        matches = bytes(driver.buf) == pack_pages(test)
+    except Exception as e:
+        matches = False
+    lcd.clear()
+    return driver if matches else None
+
+
+# Fast path for frame conversion, verified against the library at start-up
+lcd_page_driver = find_lcd_page_driver()
+# Partial updates address pages and columns directly, so they need the verified driver
+lcd_region_writes = lcd_page_driver is not None and all(
+    hasattr(lcd_page_driver, name) for name in ("_command", "_data", "_is_setup"))
+
+
+class DisplayBus:
+    """
+    Single owner of the GFX HAT display, backlight and touch LEDs.
+    Any thread can submit a command without waiting on the bus; the worker thread
+    applies them in order and keeps only the latest pending command per target,
+    so stacked frames or several brightness steps collapse into one write.
+    """
+
+    def __init__(self):
+        self.pending = {}  # (command, target) -> latest value, in submission order
+        self.busy = False
+        self.backlight_color = (0, 0, 0)  # Last colour submitted, used to restore after idle
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="display-bus", daemon=True)
+        self.thread.start()
+
+    def submit(self, command, target, value):
+        """Queue a command, replacing any pending command for the same target."""
+        with self.condition:
+            self.pending.pop((command, target), None)
+            self.pending[(command, target)] = value
+            self.condition.notify_all()
+
+    def show_frame(self, frame):
+        """Queue a copy of the frame to be pushed to the LCD."""
+        self.submit("frame", None, frame.copy())
+
+    def show_region(self, frame, box):
+        """Queue a copy of a page-aligned (x0, y0, x1, y1) region of the frame to be pushed to the LCD."""
+        self.submit("region", box, frame.crop(box))
+
+    def set_backlight(self, r, g, b):
+        """Queue a colour for the whole backlight."""
+        self.backlight_color = (int(r), int(g), int(b))
+        self.submit("backlight", None, self.backlight_color)
+
+    def set_led(self, index, state):
+        """Queue a touch button LED state."""
+        self.submit("led", index, state)
+
+    def set_contrast(self, value):
+        """Queue an LCD contrast change."""
+        self.submit("contrast", None, value)
+
+    def flush(self, timeout=1.0):
+        """Wait until every queued command has been written to the hardware."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.pending or self.busy:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def run(self):
+        """Worker loop: apply coalesced commands as they arrive."""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                batch = list(self.pending.items())
+                self.pending.clear()
+                self.busy = True
+            for (command, target), value in batch:
+                try:
+                    self.apply(command, target, value)
+                except Exception as e:
+                    pass  # A failed bus write must not kill the worker
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def apply(self, command, target, value):
+        """Perform one bus transaction. Only called from the worker thread."""
+        if command == "frame":
+            if lcd_page_driver is not None:
+                lcd_page_driver.buf[:] = pack_pages(value)
+            else:
+                lcd.clear()
+                lcd.set_image(value)
+            lcd.show()
+        elif command == "region":
+            # Write only the pages and columns of the region; the rest of the LCD is untouched
+            x0, y0, x1, y1 = target
+            width = x1 - x0
+            data = pack_pages(value)
+            if not lcd_page_driver._is_setup:
+                lcd.show()  # Let the library set up the bus before the first direct write
+            for idx, page in enumerate(range(y0 // 8, y1 // 8)):
+                columns = data[idx * width:(idx + 1) * width]
+                offset = page * DISPLAY_WIDTH + x0
+                lcd_page_driver.buf[offset:offset + width] = columns
+                lcd_page_driver._command([ST7567_SETPAGESTART | page,
+                                          ST7567_SETCOLL | (x0 & 0x0F),
+                                          ST7567_SETCOLH | (x0 >> 4)])
+                lcd_page_driver._data(list(columns))
+        elif command == "backlight":
+            backlight.set_all(*value)
+            backlight.show()
+        elif command == "led":
+            touch.set_led(target, value)
+        elif command == "contrast":
+            lcd.contrast(value)
+
+
+# All display, backlight and LED writes after start-up go through this worker
+display_bus = DisplayBus()
+
 # Initialize image buffer
 image = Image.new('1', (DISPLAY_WIDTH, DISPLAY_HEIGHT), "black")
 draw = ImageDraw.Draw(image)
@@ -46,26 +278,281 @@ font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
 # Colors
 BLACK = 0
 WHITE = 1
+LINE_HEIGHT = FONT_SIZE - 0.7  # Vertical spacing of text lines
+
+
+def present_frame(frame):
+    """Send a rendered frame to the GFX HAT. Only called from the render thread."""
+    display_bus.show_frame(frame)
+
+
+def present_region(frame, box):
+    """
+    Send a page-aligned region of a rendered frame to the GFX HAT, or the whole
+    frame if the driver does not allow partial writes. Only called from the render thread.
+    """
+    if lcd_region_writes:
+        display_bus.show_region(frame, box)
+    else:
+        display_bus.show_frame(frame)
+
+
+class Renderer:
+    """
+    Dedicated render thread that owns rasterizing and presenting frames.
+    Input loops submit immutable frame descriptions, either
+    ("lines", tuple_of_lines, underline_spans, completion), ("menu", tuple_of_lines) or
+    ("image", image_copy), and return at once. The thread rasterizes the newest
+    frame into a back buffer, swaps it to the front and presents it. Frames submitted
+    while it is busy replace each other, so a slow display drops intermediate frames
+    instead of delaying key handling. The activity indicator lives in its own strip at
+    the right edge; stepping it redraws and presents only that strip.
+    Menu frames are kept rasterized in an LRU cache (and can be rendered ahead of
+    time while the thread is idle), and only the rows that differ from the frame on
+    the panel are presented.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending_frame = None
+        self.pending_calls = []  # Hardware calls that must stay ordered with frame output
+        self.busy = False
+        self.last_frame = None  # Newest submitted frame, so callers can skip duplicates
+        self.activity = None  # Animation step of the activity indicator, or None when hidden
+        self.pending_activity = None
+        self.activity_changed = False
+        self.front = Image.new('1', image.size)
+        self.back = Image.new('1', image.size)
+        self.back_draw = ImageDraw.Draw(self.back)
+        # FreeType faces are not thread-safe, so the render thread gets its own
+        self.font = font.font_variant() if hasattr(font, "font_variant") else font
+        self.render_time_total = 0.0  # Cumulative seconds spent rendering, for chat telemetry
+        self.render_count = 0
+        self.dropped_frames = 0
+        self.key_time = None  # Arrival time of the newest key not yet answered by a frame
+        self.pending_key_time = None
+        self.input_latencies = deque(maxlen=INPUT_LATENCY_SAMPLES)  # Seconds from key arrival to its frame on the panel
+        self.menu_frames = OrderedDict()  # Menu lines -> rasterized image, least recently used first
+        self.prerender_queue = []  # Menu frames to rasterize into the cache when idle
+        self.thread = threading.Thread(target=self.run, name="render", daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        """Queue a frame for display, replacing any frame not yet rendered."""
+        with self.condition:
+            if self.pending_frame is not None:
+                self.dropped_frames += 1
+            self.pending_frame = frame
+            self.last_frame = frame
+            if self.key_time is not None:
+                # The first frame after a key is its response; keep the oldest key if frames merge
+                if self.pending_key_time is None and time.time() - self.key_time < INPUT_LATENCY_WINDOW:
+                    self.pending_key_time = self.key_time
+                self.key_time = None
+            self.condition.notify_all()
+
+    def note_key(self, timestamp):
+        """Record when a key arrived, so the time until its frame is presented can be measured."""
+        with self.condition:
+            self.key_time = timestamp
+
+    def prerender(self, frames):
+        """Replace the queue of menu frames to render into the cache while nothing else is pending."""
+        with self.condition:
+            self.prerender_queue = list(frames)
+            self.condition.notify_all()
+
+    def set_activity(self, step):
+        """Show the activity indicator at an animation step, or hide it with None."""
+        with self.condition:
+            self.pending_activity = step
+            self.activity_changed = True
+            self.condition.notify_all()
+
+    def call(self, function, *args):
+        """Run a hardware call on the render thread, before the next frame is presented."""
+        with self.condition:
+            self.pending_calls.append((function, args))
+            self.condition.notify_all()
+
+    def refresh(self):
+        """Present the front buffer again, e.g. after the panel was powered back on."""
+        self.call(lambda: present_frame(self.front))
+
+    def flush(self, timeout=1.0):
+        """Wait until every queued frame and call has been presented."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.pending_frame is not None or self.pending_calls or self.busy:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def run(self):
+        """Render loop: apply queued calls, then rasterize, swap and present the newest frame."""
+        while True:
+            with self.condition:
+                while (self.pending_frame is None and not self.pending_calls and not self.activity_changed
+                       and not self.prerender_queue):
+                    self.condition.wait()
+                calls, self.pending_calls = self.pending_calls, []
+                frame, self.pending_frame = self.pending_frame, None
+                key_time, self.pending_key_time = self.pending_key_time, None
+                activity_changed, self.activity_changed = self.activity_changed, False
+                self.activity = self.pending_activity
+                prerender = None
+                if frame is None and not calls and not activity_changed:
+                    prerender = self.prerender_queue.pop()  # Only when there is nothing to show
+                self.busy = True
+            if prerender is not None and prerender[1] not in self.menu_frames:
+                try:
+                    self.render_menu(prerender[1])
+                except Exception as e:
+                    pass
+            for function, args in calls:
+                try:
+                    function(*args)
+                except Exception as e:
+                    pass  # A failed hardware call must not kill the render thread
+            if frame is not None:
+                render_start = time.perf_counter()
+                try:
+                    self.rasterize(frame)
+                    self.front, self.back = self.back, self.front
+                    self.back_draw = ImageDraw.Draw(self.back)
+                    if frame[0] == "menu":
+                        # Moving the selection changes two rows: send only the pages they cover
+                        box = ImageChops.logical_xor(self.front, self.back).getbbox()
+                        if box is not None:
+                            present_region(self.front, (box[0], box[1] // 8 * 8, box[2],
+                                                        min(-(-box[3] // 8) * 8, self.front.height)))
+                    else:
+                        present_frame(self.front)
+                except Exception as e:
+                    pass
+                self.render_time_total += time.perf_counter() - render_start
+                self.render_count += 1
+                if key_time is not None:
+                    self.input_latencies.append(time.time() - key_time)
+            elif activity_changed:
+                # Only the indicator moved: redraw and present just its strip of the front buffer
+                try:
+                    present_region(self.front, self.draw_activity(ImageDraw.Draw(self.front)))
+                except Exception as e:
+                    pass
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def rasterize(self, frame):
+        """Draw a frame description into the back buffer."""
+        kind, content = frame[:2]
+        if kind == "menu":
+            cached = self.menu_frames.get(content)
+            if cached is None:
+                cached = self.render_menu(content)
+            else:
+                self.menu_frames.move_to_end(content)
+            self.back.paste(cached)
+            if self.activity is not None:
+                self.draw_activity(self.back_draw)
+        elif kind == "lines":
+            self.back_draw.rectangle((0, 0) + self.back.size, outline=BLACK, fill=BLACK)
+            for idx, line in enumerate(content):
+                self.back_draw.text((0, idx * LINE_HEIGHT), line, font=self.font, fill=WHITE)
+            for idx, start, end in frame[2]:
+                # Underline characters start:end of line idx (used for misspelled words)
+                line = content[idx]
+                x0 = self.back_draw.textlength(line[:start], font=self.font)
+                x1 = self.back_draw.textlength(line[:end], font=self.font)
+                y = idx * LINE_HEIGHT + LINE_HEIGHT - 1
+                self.back_draw.line((x0, y, x1, y), fill=WHITE)
+            if self.activity is not None:
+                self.draw_activity(self.back_draw)
+            if frame[3] and content:
+                # Offered word completion, shown inverted after the last line
+                y = (len(content) - 1) * LINE_HEIGHT
+                x0 = self.back_draw.textlength(content[-1], font=self.font)
+                x1 = x0 + self.back_draw.textlength(frame[3], font=self.font)
+                self.back_draw.rectangle((x0, y, x1, y + LINE_HEIGHT - 1), outline=WHITE, fill=WHITE)
+                self.back_draw.text((x0, y), frame[3], font=self.font, fill=BLACK)
+        else:
+            self.back.paste(content)
+
+    def render_menu(self, lines):
+        """Rasterize menu lines into a new cached image, evicting the least recently used."""
+        menu_image = Image.new('1', self.back.size)
+        menu_draw = ImageDraw.Draw(menu_image)
+        for idx, line in enumerate(lines):
+            menu_draw.text((0, idx * LINE_HEIGHT), line, font=self.font, fill=WHITE)
+        self.menu_frames[lines] = menu_image
+        while len(self.menu_frames) > MENU_FRAME_CACHE_SIZE:
+            self.menu_frames.popitem(last=False)
+        return menu_image
+
+    def draw_activity(self, target_draw):
+        """
+        Draw the activity indicator (a bar bouncing down the right edge) and
+        return the page-aligned box of its strip.
+        """
+        width, height = self.front.size
+        box = (width - ACTIVITY_STRIP_WIDTH, 0, width, height)
+        target_draw.rectangle((box[0], 0, width - 1, height - 1), outline=BLACK, fill=BLACK)
+        if self.activity is not None:
+            travel = height - ACTIVITY_BAR_LENGTH
+            position = (self.activity * ACTIVITY_STEP_PIXELS) % (2 * travel)
+            y = position if position <= travel else 2 * travel - position
+            target_draw.rectangle((box[0], y, width - 1, y + ACTIVITY_BAR_LENGTH - 1), outline=WHITE, fill=WHITE)
+        return box
+
+
+# Only the render thread rasterizes into its buffers and presents frames
+renderer = Renderer()
+
 
 # Key codes
-ESCAPE = 27
-ENTER_KEYS = [10, 13, curses.KEY_ENTER]
+UNDO_KEY = 21  # Ctrl-U (Ctrl-Z would suspend the process in cbreak mode)
+REDO_KEY = 18  # Ctrl-R
+DOCUMENT_SWITCH_KEY = 14  # Ctrl-N
+SPELL_SUGGEST_KEY = 7  # Ctrl-G
+SPELL_SUGGEST_POLL = 0.05  # Seconds between checks for finished suggestions; Escape is read in between
+CHAT_STOP_KEY = 24  # Ctrl-X stops the answer being generated
+PROFILER_KEY = 16  # Ctrl-P starts and stops the sampling profiler from any screen
+COMPLETION_KEY = 9  # Tab accepts the offered word completion
+ASK_DOCUMENT_KEY = 1  # Ctrl-A asks AlphaChat about the open document
 
 # Global Variables for AlphaChat
-alpha_chat_api_key = ""
 alpha_chat_model = "gpt-4o-mini"  # Default model
+alpha_chat_backend = DEFAULT_BACKEND
+alpha_chat_backends = {name: dict(preset) for name, preset in BACKEND_PRESETS.items()}
+idle_dim_seconds = IDLE_DIM_SECONDS
+idle_sleep_seconds = IDLE_SLEEP_SECONDS
+persist_undo = False  # Save undo history alongside documents
+sync_target = ""  # Directory (e.g. a mounted USB stick) the library is synced to
+spell_check = True  # Underline misspelled words in the word processor
+word_completion = True  # Offer completions of the word being typed
+stream_frame_rate = STREAM_FRAME_RATE
+keyboard_backend = "curses"  # "evdev" reads /dev/input directly instead of the terminal
+keyboard_devices = []  # Event device paths for the evdev backend; empty uses every keyboard
+
+# Last chosen option of each remembered menu, by menu title
+menu_selections = {}
+
+# Open word processor documents, least recently used first
+open_documents = OrderedDict()
+
 chat_history = []
-chat_lock = threading.Lock()
+chat_sessions = []  # Open AlphaChat sessions, most recently used last
 
 # Initialize OpenAI client as None at global scope
 client = None
 
 
 def update_display(image):
-    """Update the GFX HAT display with the current image buffer."""
-    lcd.clear()
-    lcd.set_image(image)
-    lcd.show()
+    """Queue a copy of the image buffer for the GFX HAT display without waiting on rendering or the bus."""
+    renderer.submit(("image", image.copy()))
 
 
 def clear_image():
@@ -74,6 +561,29 @@ def clear_image():
     update_display(image)
 
 
+def set_panel_state(state):
+    """
+    Switches the panel between 'on', 'dim' and 'off' for idle power saving.
+    Dimming and powering off only change the backlight; turning back on
+    restores the previous backlight colour and re-sends the last rendered frame.
+    """
+    if not hasattr(set_panel_state, "saved_backlight"):
+        set_panel_state.saved_backlight = None
+
+    if state == "on":
+        if set_panel_state.saved_backlight is not None:
+            display_bus.set_backlight(*set_panel_state.saved_backlight)
+            set_panel_state.saved_backlight = None
+        renderer.refresh()
+    else:
+        if set_panel_state.saved_backlight is None:
+            set_panel_state.saved_backlight = display_bus.backlight_color
+        if state == "dim":
+            display_bus.set_backlight(*(c // IDLE_DIM_DIVISOR for c in set_panel_state.saved_backlight))
+        else:
+            display_bus.set_backlight(0, 0, 0)
+
+
 def show_splash_screen():
     """Display a splash screen on the GFX HAT."""
     try:
@@ -108,61 +618,391 @@ def wrap_text(text, max_chars_per_line=18):
     return lines
 
 
-def line_writer(lines, scroll_offset=0):
+def wrap_offsets(text, max_chars_per_line=18, line_start=0):
     """
-    Writes pre-wrapped lines to the GFX HAT display, handling scrolling.
-    Only updates the display if the content has changed to prevent flickering.
+    Wraps text by the same rules as wrap_text(), but returns an array('I') of
+    (start, end) offsets into text for each line instead of new strings.
+    line_start, which must begin a paragraph, skips wrapping the text before it.
+    """
+    offsets = array('I')
+    length = len(text)
+    while True:
+        line_end = text.find('\n', line_start)
+        if line_end == -1:
+            line_end = length
+        start = line_start
+        while line_end - start > max_chars_per_line:
+            # Attempt to wrap at the last space within max_chars_per_line
+            wrap_at = text.rfind(' ', start, start + max_chars_per_line)
+            if wrap_at == -1:
+                wrap_at = start + max_chars_per_line
+            offsets.append(start)
+            offsets.append(wrap_at)
+            start = wrap_at
+            while start < line_end and text[start].isspace():
+                start += 1
+        offsets.append(start)
+        offsets.append(line_end)
+        if line_end == length:
+            return offsets
+        line_start = line_end + 1
+
+
+class WrappedText:
+    """
+    Wrapped view of a document: one text buffer plus the (start, end) offsets of
+    each wrapped line, so a large document costs 8 bytes per line rather than a
+    str object per line. Indexing and slicing build strings for only the lines asked for.
     """
-    if not hasattr(line_writer, "previous_display_lines"):
-        line_writer.previous_display_lines = []
-    if not hasattr(line_writer, "previous_scroll"):
-        line_writer.previous_scroll = 0
 
-    display_lines = lines[scroll_offset:scroll_offset + MAX_DISPLAY_LINES]
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, text, max_chars_per_line=18):
+        self.text = text
+        self.offsets = wrap_offsets(text, max_chars_per_line)
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("wrapped line index out of range")
+        return self.text[self.offsets[2 * index]:self.offsets[2 * index + 1]]
+
+    def rewrap(self, text, changed_from, max_chars_per_line=18):
+        """
+        Return a WrappedText for text, which is unchanged from this view's text before
+        changed_from. Only the paragraphs from the one holding changed_from are rewrapped.
+        """
+        paragraph_start = text.rfind('\n', 0, changed_from) + 1
+        # Binary search for the first line of that paragraph; the lines before it are kept
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.offsets[2 * middle] < paragraph_start:
+                low = middle + 1
+            else:
+                high = middle
+        wrapped = WrappedText.__new__(WrappedText)
+        wrapped.text = text
+        wrapped.offsets = self.offsets[:2 * low]
+        wrapped.offsets.extend(wrap_offsets(text, max_chars_per_line, paragraph_start))
+        return wrapped
 
-    if (display_lines == line_writer.previous_display_lines and
-            scroll_offset == line_writer.previous_scroll):
-        return  # No change, no need to update
+    def size(self):
+        """Approximate bytes held by the offsets; the text buffer belongs to the document."""
+        return len(self.offsets) * self.offsets.itemsize
 
+
+def line_writer(lines, scroll_offset=0, underlines=(), completion=""):
+    """
+    Writes pre-wrapped lines (a list or a WrappedText) to the GFX HAT display, handling scrolling.
+    Only the visible lines are sliced out.
+    Only submits a frame if the content has changed to prevent flickering;
+    drawing and the display transfer happen on the render thread.
+    underlines holds (visible line index, start, end) character spans to underline.
+    completion is the rest of an offered word, shown after the last visible line.
+    """
+    frame = ("lines", tuple(lines[scroll_offset:scroll_offset + MAX_DISPLAY_LINES]), tuple(underlines), completion)
+    if frame != renderer.last_frame:
+        renderer.submit(frame)
+
+
+def start_input_backend():
+    """Switch to the evdev backend when the config asks for it and it can be opened."""
+    global input_backend
+    if keyboard_backend != "evdev":
+        return
+    if evdev is None:
+        message = "evdev not installed,\nusing curses."
+    else:
+        try:
+            input_backend = EvdevInput(keyboard_devices or None)
+            return
+        except Exception as e:
+            message = "No keyboard device,\nusing curses."
     clear_image()
+    draw.text((0, 0), message, font=font, fill=WHITE)
+    update_display(image)
+    time.sleep(1)
+
+
+def log_input_latency():
+    """Append key-to-frame latency percentiles for the keys since the last call to the metrics log."""
+    samples = sorted(renderer.input_latencies)
+    renderer.input_latencies.clear()
+    if not samples:
+        return
+    def percentile(fraction):
+        return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 1)
+    append_metrics_log({
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "kind": "input_latency",
+        "input_backend": input_backend.name,
+        "keys": len(samples),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(samples[-1] * 1000, 1),
+    })
+
+
+# Keys are read through this backend; main() swaps in EvdevInput when configured
+input_backend = CursesInput()
+
+
+class IdleManager:
+    """
+    Tracks user inactivity and steps the device through awake, dimmed and asleep.
+    Dimmed lowers the panel brightness and slows the input poll to IDLE_POLL_INTERVAL;
+    asleep powers the panel down and parks the caller on a blocking getch.
+    The image buffer is left untouched, so waking restores the exact frame.
+    """
 
-    for idx, line in enumerate(display_lines):
-        y = idx * (FONT_SIZE - 0.7)  # Adjust spacing as needed
-        draw.text((0, y), line, font=font, fill=WHITE)
+    def __init__(self):
+        self.last_activity = time.time()
+        self.state = "awake"
+
+    def note_activity(self):
+        """Record user activity that did not come through read_key (e.g. touch buttons)."""
+        self.last_activity = time.time()
+
+    def read_key(self, stdscr, keep_awake=False):
+        """
+        Drop-in replacement for stdscr.getch() in the polling loops.
+        keep_awake holds off dimming while background work (e.g. streaming) updates the screen.
+        """
+        key = input_backend.getch(stdscr)
+        now = time.time()
+        if key != curses.ERR or keep_awake:
+            self.last_activity = now
+        if key != curses.ERR:
+            renderer.note_key(input_backend.last_key_time)
+        if key == PROFILER_KEY:
+            message = sampling_profiler.toggle()
+            clear_image()
+            draw.text((0, 0), message, font=font, fill=WHITE)
+            update_display(image)
+            time.sleep(1)
+            renderer.last_frame = None  # Make the interrupted screen redraw
+            return curses.ERR
+        idle_time = now - self.last_activity
+        if idle_sleep_seconds and idle_time >= idle_sleep_seconds:
+            return self.sleep(stdscr)
+        if idle_dim_seconds and idle_time >= idle_dim_seconds:
+            if self.state == "awake":
+                self.state = "dimmed"
+                set_panel_state("dim")
+                input_backend.set_timeout(stdscr, int(IDLE_POLL_INTERVAL * 1000))  # Low-rate wakeups while dimmed
+        elif self.state != "awake":
+            self.wake(stdscr)
+        return key
+
+    def wait_key(self, stdscr, timeout):
+        """Like read_key, but waits up to timeout seconds for a key instead of returning at once."""
+        input_backend.set_timeout(stdscr, int(timeout * 1000))
+        try:
+            return self.read_key(stdscr)
+        finally:
+            # Back to the poll rate of the current state
+            input_backend.set_timeout(stdscr, int(IDLE_POLL_INTERVAL * 1000) if self.state == "dimmed" else 0)
 
-    update_display(image)
-    line_writer.previous_display_lines = display_lines.copy()
-    line_writer.previous_scroll = scroll_offset
+    def sleep(self, stdscr):
+        """Power the panel down and block until a key is pressed. The waking key is swallowed."""
+        self.state = "asleep"
+        set_panel_state("off")
+        input_backend.set_timeout(stdscr, -1)  # Blocking wait, no CPU used until the next key
+        while input_backend.getch(stdscr) == curses.ERR:
+            pass  # Interrupted by a signal (e.g. the profiler), keep sleeping
+        self.last_activity = time.time()
+        self.wake(stdscr)
+        return curses.ERR
+
+    def wake(self, stdscr):
+        """Restore the panel and non-blocking input."""
+        self.state = "awake"
+        input_backend.set_timeout(stdscr, 0)
+        set_panel_state("on")
+
+
+# Shared by every input loop so inactivity is tracked across menus and apps
+idle_manager = IdleManager()
+
+
+sampling_profiler = SamplingProfiler(PROFILE_DIR)
+
+
+class ChatTranscript:
+    """
+    Wrapped AlphaChat transcript kept as separate segments: committed messages,
+    the streaming answer tail and the input line. Each segment is wrapped only
+    when it changes and window() resolves just the visible lines, so a redraw
+    costs the same however long the chat gets.
+    """
+
+    def __init__(self):
+        self.committed_lines = []  # Wrapped lines of finished messages
+        self.tail_lines = []       # Wrapped lines of the answer being streamed
+        self.tail_stable = 0       # Tail lines belonging to finished paragraphs
+        self.tail_paragraph = ""   # Text of the tail paragraph still being written
+        self.input_lines = []      # Wrapped lines of the input line
+        self.input_text = None
+
+    def commit(self, text):
+        """Wrap and append a finished message."""
+        self.committed_lines.extend(wrap_text(text))
+
+    def start_tail(self, text=""):
+        """Begin a new streaming tail with the given text."""
+        self.tail_lines = []
+        self.tail_stable = 0
+        self.tail_paragraph = ""
+        self.append_tail(text)
+
+    def append_tail(self, delta):
+        """Append streamed text to the tail, rewrapping only the open paragraph."""
+        paragraphs = (self.tail_paragraph + delta).split('\n')
+        del self.tail_lines[self.tail_stable:]
+        for paragraph in paragraphs[:-1]:
+            self.tail_lines.extend(wrap_text(paragraph))
+        self.tail_stable = len(self.tail_lines)
+        self.tail_paragraph = paragraphs[-1]
+        self.tail_lines.extend(wrap_text(self.tail_paragraph))
+
+    def commit_tail(self):
+        """Move the finished tail into the committed messages."""
+        self.committed_lines.extend(self.tail_lines)
+        self.tail_lines = []
+        self.tail_stable = 0
+        self.tail_paragraph = ""
+
+    def set_input(self, text):
+        """Set the input line, rewrapping it only if it changed."""
+        if text != self.input_text:
+            self.input_text = text
+            self.input_lines = wrap_text(text)
+
+    def total_lines(self):
+        """Return the number of wrapped lines across all segments."""
+        return len(self.committed_lines) + len(self.tail_lines) + len(self.input_lines)
+
+    def window(self, start, count):
+        """Return up to count wrapped lines starting at line index start."""
+        lines = []
+        for segment in (self.committed_lines, self.tail_lines, self.input_lines):
+            if start < len(segment):
+                lines.extend(segment[start:start + count - len(lines)])
+                start = 0
+            else:
+                start -= len(segment)
+            if len(lines) >= count:
+                break
+        return lines
+
+
+def client_settings():
+    """Return the OpenAI client arguments for the active backend."""
+    settings = alpha_chat_backends[alpha_chat_backend]
+    api_key = settings.get("api_key", "")
+    if not settings.get("needs_api_key", True) and not api_key:
+        api_key = "no-key"  # Local servers ignore the key, but the SDK requires one
+    return {
+        "api_key": api_key,
+        "base_url": settings["base_url"],
+        "timeout": settings.get("timeout", 60.0)
+    }
+
+
+def create_client():
+    """Create an OpenAI-compatible client for the active backend (used for model discovery)."""
+    return OpenAI(**client_settings())
+
+
+def backend_needs_api_key():
+    """Return True if the active backend requires an API key that has not been entered."""
+    settings = alpha_chat_backends[alpha_chat_backend]
+    return settings.get("needs_api_key", True) and not settings.get("api_key")
+
+
+def discover_models():
+    """
+    Returns the models offered by the active backend.
+    Backends with discover_models query /v1/models and cache the result in the config;
+    on failure the cached (or preset) list is returned.
+    """
+    settings = alpha_chat_backends[alpha_chat_backend]
+    if settings.get("discover_models"):
+        try:
+            # No retries: this runs while a menu waits, so an unreachable server fails fast
+            listing = client.with_options(timeout=MODEL_DISCOVERY_TIMEOUT, max_retries=0).models.list()
+            models = sorted(model.id for model in listing)
+            if models and models != settings.get("models"):
+                settings["models"] = models
+                save_config()
+        except Exception as e:
+            pass  # Server unreachable, fall back to the cached list
+    return list(settings.get("models", []))
 
 
 def load_config():
     """Load configuration from the CONFIG_FILE if it exists."""
-    global alpha_chat_api_key, alpha_chat_model, client
+    global alpha_chat_model, alpha_chat_backend, alpha_chat_backends, client
+    global idle_dim_seconds, idle_sleep_seconds, persist_undo, sync_target, spell_check, word_completion
+    global stream_frame_rate, keyboard_backend, keyboard_devices
+    alpha_chat_backends = {name: dict(preset) for name, preset in BACKEND_PRESETS.items()}
     if path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r') as f:
                 config = json.load(f)
-                alpha_chat_api_key = config.get("api_key", "")
                 alpha_chat_model = config.get("model", "gpt-4o-mini")
-                # Initialize the OpenAI client with the API key
-                client = OpenAI(api_key=alpha_chat_api_key)
+                alpha_chat_backend = config.get("backend", DEFAULT_BACKEND)
+                idle_dim_seconds = config.get("idle_dim_seconds", IDLE_DIM_SECONDS)
+                idle_sleep_seconds = config.get("idle_sleep_seconds", IDLE_SLEEP_SECONDS)
+                persist_undo = config.get("persist_undo", False)
+                sync_target = config.get("sync_target", "")
+                spell_check = config.get("spell_check", True)
+                word_completion = config.get("word_completion", True)
+                stream_frame_rate = config.get("stream_frame_rate", STREAM_FRAME_RATE)
+                keyboard_backend = config.get("input_backend", "curses")
+                keyboard_devices = config.get("input_devices", [])
+                # Saved backend settings override (or extend) the presets
+                for name, settings in config.get("backends", {}).items():
+                    alpha_chat_backends.setdefault(name, {}).update(settings)
+                # Older configs kept a single OpenAI key at the top level
+                if config.get("api_key"):
+                    alpha_chat_backends[DEFAULT_BACKEND].setdefault("api_key", config["api_key"])
         except Exception as e:
             # If there's an error reading the config, proceed with defaults
-            alpha_chat_api_key = ""
             alpha_chat_model = "gpt-4o-mini"
-            client = OpenAI(api_key=alpha_chat_api_key)  # Initialize with empty API key
+            alpha_chat_backend = DEFAULT_BACKEND
     else:
         # Config file does not exist, proceed with defaults
-        alpha_chat_api_key = ""
         alpha_chat_model = "gpt-4o-mini"
-        client = OpenAI(api_key=alpha_chat_api_key)  # Initialize with empty API key
+        alpha_chat_backend = DEFAULT_BACKEND
+    if "base_url" not in alpha_chat_backends.get(alpha_chat_backend, {}):
+        alpha_chat_backend = DEFAULT_BACKEND
+    client = create_client()
 
 
 def save_config():
     """Save current configuration to the CONFIG_FILE."""
     config = {
-        "api_key": alpha_chat_api_key,
-        "model": alpha_chat_model
+        "model": alpha_chat_model,
+        "backend": alpha_chat_backend,
+        "backends": alpha_chat_backends,
+        "idle_dim_seconds": idle_dim_seconds,
+        "idle_sleep_seconds": idle_sleep_seconds,
+        "persist_undo": persist_undo,
+        "sync_target": sync_target,
+        "spell_check": spell_check,
+        "word_completion": word_completion,
+        "stream_frame_rate": stream_frame_rate,
+        "input_backend": keyboard_backend,
+        "input_devices": keyboard_devices
     }
     try:
         with open(CONFIG_FILE, 'w') as f:
@@ -172,6 +1012,75 @@ def save_config():
         pass
 
 
+def percentile(values, pct):
+    """Return the nearest-rank pct-th percentile of values, or 0.0 if there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimate the USD cost of a request from MODEL_PRICING (0.0 for unknown models)."""
+    prompt_price, completion_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000000
+
+
+def build_chat_metrics(model, request_start, request_end, chunk_times, usage,
+                       messages, response_text, render_time, render_count, error=None):
+    """
+    Builds a telemetry record for one streamed chat request.
+    TTFT and inter-chunk gaps reflect network and model speed, while
+    render_ms_per_frame shows how long the render thread took per frame during the stream.
+    When the server reports no usage, token counts are estimated (~4 chars per token).
+    """
+    gaps = [b - a for a, b in zip(chunk_times, chunk_times[1:])]
+    if usage is not None:
+        prompt_tokens = usage["prompt_tokens"]
+        completion_tokens = usage["completion_tokens"]
+    else:
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        completion_tokens = len(chunk_times)
+    ttft = chunk_times[0] - request_start if chunk_times else None
+    generation_time = chunk_times[-1] - chunk_times[0] if len(chunk_times) > 1 else 0.0
+    return {
+        "timestamp": time.time(),
+        "model": model,
+        "ttft_s": round(ttft, 3) if ttft is not None else None,
+        "total_s": round(request_end - request_start, 3),
+        "chunks": len(chunk_times),
+        "gap_p50_ms": round(percentile(gaps, 50) * 1000, 1),
+        "gap_p90_ms": round(percentile(gaps, 90) * 1000, 1),
+        "gap_p99_ms": round(percentile(gaps, 99) * 1000, 1),
+        "tokens_per_s": round(completion_tokens / generation_time, 1) if generation_time else 0.0,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "usage_estimated": usage is None,
+        "response_chars": len(response_text),
+        "cost_usd": round(estimate_cost(model, prompt_tokens, completion_tokens), 6),
+        "render_frames": render_count,
+        "render_ms_per_frame": round(render_time / render_count * 1000, 1) if render_count else 0.0,
+        "error": error,
+    }
+
+
+def format_metrics_summary(record):
+    """Format a compact one-line summary of a chat telemetry record."""
+    ttft = "-" if record["ttft_s"] is None else f"{record['ttft_s']:.1f}s"
+    return f"[{ttft} {record['tokens_per_s']:.0f}t/s ${record['cost_usd']:.4f}]"
+
+
+def append_metrics_log(record):
+    """Append a telemetry record to METRICS_LOG_FILE as one JSON line."""
+    try:
+        with open(METRICS_LOG_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except Exception as e:
+        # Telemetry must never interrupt a chat
+        pass
+
+
 def main(stdscr):
     """Main function to initialize the application."""
     # Initialize curses
@@ -179,171 +1088,263 @@ def main(stdscr):
     stdscr.nodelay(True)        # Non-blocking input
     stdscr.keypad(True)
 
-    # Start touch event handling in a separate thread
-    touch_thread = threading.Thread(target=touch_event_thread, daemon=True)
-    touch_thread.start()
+    # Light up the buttons and register the touch handlers; the touch driver calls them from its own thread
+    scheduler.submit(PRIORITY_INPUT, setup_touch_buttons, name="touch-setup")
 
     load_config()  # Load existing configuration
+    # `pkill -USR1 -f <script>` starts and stops the profiler from an ssh session
+    signal.signal(signal.SIGUSR1, lambda signum, frame: sampling_profiler.toggle())
+    start_input_backend()
+    if word_completion:
+        completion_index.start()  # Load and refresh the completion index in the background
     show_splash_screen()
-    main_menu(stdscr)
+    MAIN_MENU.run(stdscr)
+    finish_saves()
 
-def touch_event_thread():
-    """Thread to handle touch events and update LEDs accordingly."""
+def setup_touch_buttons():
+    """Run the LED start-up sequence and register handlers that adjust the backlight on touch."""
     backlight_on = False
     brightness = 127.5
     def handler(ch, event):
         nonlocal backlight_on, brightness
         if event == 'press':
+            idle_manager.note_activity()
             if ch == 4:
                 backlight_on = not backlight_on
-                touch.set_led(4, backlight_on and 1 or 0)
+                display_bus.set_led(4, backlight_on and 1 or 0)
             elif ch == 5:
                 brightness = min(brightness + 25.5, 255)
             elif ch == 3:
                 brightness = max(brightness - 25.5, 0)
             if backlight_on:
-                backlight.set_all(int(brightness), int(brightness), int(brightness))
+                display_bus.set_backlight(brightness, brightness, brightness)
             else:
-                backlight.set_all(0, 0, 0)
-            backlight.show()
+                display_bus.set_backlight(0, 0, 0)
 
     # Initialize LEDs and set handlers
     for x in range(6):
-        touch.set_led(x, 1)
+        display_bus.set_led(x, 1)
         time.sleep(0.1)
-        touch.set_led(x, 0)
+        display_bus.set_led(x, 0)
 
     # Only use the bottom 3 buttons
     for x in range(3, 7):
         touch.on(x, handler)
 
-    backlight.set_all(int(brightness), int(brightness), int(brightness))
-    backlight.show()
-
-    # Keep the thread alive until shutdown
-    while not shutdown_flag.is_set():
-        signal.pause()  # Wait for signals (e.g., touch events)
-        time.sleep(0.1)  # Small sleep to prevent tight loop
+    display_bus.set_backlight(brightness, brightness, brightness)
 
-def display_menu(stdscr, menu_options, max_display_options=MAX_DISPLAY_LINES):
+def display_menu(stdscr, menu_options, max_display_options=MAX_DISPLAY_LINES, refresh=None, remember=None):
     """
     Generic function to display a menu and handle user input.
+    Only redraws when the selection or options change, and waits for keys rather
+    than polling. The frames one step up and down are rendered ahead of time, so
+    moving the selection presents a cached frame and only the rows that changed.
     
     :param stdscr: The curses window object
     :param menu_options: List of menu options
     :param max_display_options: Maximum number of options to display at once
+    :param refresh: Optional callable polled while the menu is shown; returns a new
+                    option list when the options changed (e.g. scan results), else None
+    :param remember: Optional key under which the chosen option is kept in menu_selections,
+                     so the menu reopens on it
     :return: The selected option or None if escaped
     """
     current_selection = 0
-    scroll_offset = 0
+    if remember is not None and menu_selections.get(remember) in menu_options:
+        current_selection = menu_options.index(menu_selections[remember])
+    scroll_offset = max(current_selection - max_display_options + 1, 0)
 
-    while True:
-        # Prepare display lines
-        visible_options = menu_options[scroll_offset:scroll_offset + max_display_options]
-        display_lines = []
-        for idx, option in enumerate(visible_options):
-            if idx + scroll_offset == current_selection:
-                line = "> " + option
-            else:
-                line = "  " + option
-            display_lines.append(line)
+    def menu_frame(selection, offset):
+        visible_options = menu_options[offset:offset + max_display_options]
+        return ("menu", tuple(("> " if idx + offset == selection else "  ") + option
+                              for idx, option in enumerate(visible_options)))
 
-        # Write lines to display
-        line_writer(display_lines, scroll_offset=0)
+    frame = None
+    while True:
+        if refresh is not None:
+            updated = refresh()
+            if updated is not None:
+                # Keep the same option selected if it is still there
+                selected = menu_options[current_selection] if current_selection < len(menu_options) else None
+                menu_options = updated
+                if selected in menu_options:
+                    current_selection = menu_options.index(selected)
+                else:
+                    current_selection = min(current_selection, max(len(menu_options) - 1, 0))
+                scroll_offset = min(scroll_offset, current_selection)
+                scroll_offset = max(scroll_offset, current_selection - max_display_options + 1)
+                frame = None
+
+        if frame is None:
+            frame = menu_frame(current_selection, scroll_offset)
+            neighbours = []
+            if current_selection > 0:
+                neighbours.append(menu_frame(current_selection - 1, min(scroll_offset, current_selection - 1)))
+            if current_selection < len(menu_options) - 1:
+                neighbours.append(menu_frame(current_selection + 1,
+                                             max(scroll_offset, current_selection + 2 - max_display_options)))
+            renderer.prerender(neighbours)
+        if frame != renderer.last_frame:
+            renderer.submit(frame)  # Also redraws the menu after a message or another screen
 
-        key = stdscr.getch()
+        key = idle_manager.wait_key(stdscr, IDLE_POLL_INTERVAL)
         if key == curses.KEY_UP:
             if current_selection > 0:
                 current_selection -= 1
                 if current_selection < scroll_offset:
                     scroll_offset -= 1
+                frame = None
         elif key == curses.KEY_DOWN:
             if current_selection < len(menu_options) - 1:
                 current_selection += 1
                 if current_selection >= scroll_offset + max_display_options:
                     scroll_offset += 1
+                frame = None
         elif key in ENTER_KEYS:
-            return menu_options[current_selection]
+            if menu_options:
+                if remember is not None:
+                    menu_selections[remember] = menu_options[current_selection]
+                return menu_options[current_selection]
         elif key == ESCAPE:
             return None
-        time.sleep(0.05)
 
 
-def main_menu(stdscr):
-    """Display the main menu with options to start Word Processor, AlphaChat, Settings, or quit."""
-    menu_options = ["Word Processor", "AlphaChat", "Settings", "Quit"]
-    
-    while True:
-        selected_option = display_menu(stdscr, menu_options)
-        if selected_option == "Word Processor":
-            wordprocessor_menu(stdscr)
-        elif selected_option == "AlphaChat":
-            alphachat_menu(stdscr)
-        elif selected_option == "Settings":
-            settings_menu(stdscr)
-        elif selected_option == "Quit":
-            clear_image()
-            update_display(image)
-            sys.exit(0)
-        elif selected_option is None:
-            return
+class Menu:
+    """
+    A declarative menu: a title and its (label, action) items. An action is a
+    submenu, a function called with stdscr, or None for an item that goes back.
+    The menus themselves are declared together, at the end of the file.
+    """
 
+    def __init__(self, title, items):
+        self.title = title
+        self.items = items
+
+    def run(self, stdscr):
+        """Show the menu until Back or Escape, reopening on the last chosen item."""
+        labels = [label for label, action in self.items]
+        actions = dict(self.items)
+        while True:
+            action = actions.get(display_menu(stdscr, labels, remember=self.title))
+            if action is None:
+                return
+            if isinstance(action, Menu):
+                action.run(stdscr)
+            else:
+                action(stdscr)
 
-def wordprocessor_menu(stdscr):
-    """Display the word processor menu with options to create, edit, or get help."""
-    menu_options = ["Create New File", "Edit Existing File", "Back"]
-    
-    while True:
-        selected_option = display_menu(stdscr, menu_options)
-        if selected_option == "Create New File":
-            filename = get_filename(stdscr, "Create New File")
-            if filename:
-                wordprocessor_edit(stdscr, filename, new=True)
-        elif selected_option == "Edit Existing File":
-            filename = select_file(stdscr)
-            if filename:
-                wordprocessor_edit(stdscr, filename, new=False)
-        elif selected_option == "Back" or selected_option is None:
-            return
 
+def task_status_menu(stdscr):
+    """Show the background workers, the running and queued tasks per class and recent failures, live."""
+    def status_lines():
+        status = scheduler.status()
+        lines = [f"Busy {status['busy']}/{status['threads']}"]
+        lines += [f"{name} {counts['running']}+{counts['queued']}" for name, counts in status["classes"].items()]
+        lines += [f"~{name}" for name in status["running"]]
+        lines += [f"!{name}: {error}" for name, error in status["failed"]]
+        return lines
 
-def alphachat_menu(stdscr):
-    """Display the AlphaChat menu with options to New Chat, Enter API Key, Select Model, or Back."""
-    global client
-    menu_options = ["New Chat", "Enter API Key", "Select Model", "Back"]
+    state = {"lines": None}
 
-    while True:
-        selected_option = display_menu(stdscr, menu_options)
-        if selected_option == "New Chat":
-            if not alpha_chat_api_key:
-                prompt_api_key(stdscr)
-            alphachat_new_chat(stdscr)
-        elif selected_option == "Enter API Key":
-            prompt_api_key(stdscr)
-        elif selected_option == "Select Model":
-            select_alphachat_model(stdscr)
-        elif selected_option == "Back" or selected_option is None:
-            return
+    def refresh():
+        lines = status_lines()
+        if lines == state["lines"]:
+            return None
+        state["lines"] = lines
+        return lines
 
+    while display_menu(stdscr, status_lines(), refresh=refresh) is not None:
+        pass  # Nothing to choose; Escape leaves
 
-def settings_menu(stdscr):
-    """Display the settings menu with options to change wifi settings and font."""
-    menu_options = ["WiFi", "Font", "Back"]
 
-    while True:
-        selected_option = display_menu(stdscr, menu_options)
-        if selected_option == "WiFi":
-            wifi_settings_menu(stdscr)
-        elif selected_option == "Font":
-            font_settings_menu(stdscr)
-        elif selected_option == "Back" or selected_option is None:
-            return
+def finish_saves():
+    """Queue saves of every modified open document and wait for all pending saves."""
+    for doc in list(open_documents.values()):
+        autosave_document(doc)
+    scheduler.wait(PRIORITY_SAVE, SAVE_FLUSH_TIMEOUT)
+
+
+def quit_app(stdscr):
+    """Finish pending saves, blank the display and exit."""
+    finish_saves()
+    clear_image()
+    update_display(image)
+    renderer.flush()
+    display_bus.flush()
+    sys.exit(0)
+
+
+def create_new_file(stdscr):
+    filename = get_filename(stdscr, "Create New File")
+    if filename:
+        wordprocessor_edit(stdscr, filename, new=True)
+
+
+def edit_existing_file(stdscr):
+    filename = select_file(stdscr)
+    if filename:
+        wordprocessor_edit(stdscr, filename, new=False)
+
+
+def open_documents_menu(stdscr):
+    """Switch to one of the open documents, most recently used first."""
+    if not open_documents:
+        clear_image()
+        draw.text((0, 0), "No open documents.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+    # Reopening keeps buffer, scroll and wrap cache
+    filename = display_menu(stdscr, list(reversed(open_documents)))
+    if filename:
+        wordprocessor_edit(stdscr, filename, new=False)
+
+
+def set_server_url(stdscr):
+    """Ask for the active backend's base URL."""
+    global client
+    current_url = alpha_chat_backends[alpha_chat_backend].get("base_url", "")
+    base_url = prompt_text(stdscr, "Server URL:", max_length=MAX_URL_LENGTH, text=current_url)
+    if base_url:
+        alpha_chat_backends[alpha_chat_backend]["base_url"] = base_url.rstrip('/')
+        client = create_client()
+        save_config()
+
 
 
 def wifi_settings_menu(stdscr):
-    """Display the wifi settings menu with options to connect to a WiFi network."""
-    # TODO: Implement wifi settings menu
-    pass
+    """
+    Display nearby WiFi networks and connect to the chosen one.
+    The cached scan is shown at once while a fresh scan runs in the background;
+    the list updates as results arrive. Connecting also runs in the background.
+    """
+    wifi_manager.scan_async()
+    seen = {"version": -1, "minute": None}
+
+    def refresh():
+        # Redraw when the scan or connection changes, and once a minute for the scan age
+        minute = int(time.time() // 60)
+        if wifi_manager.version == seen["version"] and minute == seen["minute"]:
+            return None
+        seen["version"], seen["minute"] = wifi_manager.version, minute
+        return wifi_manager.menu_options()[0]
+
+    while True:
+        selected_option = display_menu(stdscr, wifi_manager.menu_options()[0], refresh=refresh)
+        labels = wifi_manager.menu_options()[1]
+        if selected_option == "Back" or selected_option is None:
+            return
+        if selected_option in labels:
+            network = labels[selected_option]
+            password = None
+            if network["secure"] and not network["connected"]:
+                password = prompt_text(stdscr, "Password:", max_length=63, mask=True)  # WPA allows 63
+                if not password:
+                    continue
+            wifi_manager.connect_async(network["ssid"], password)
+        elif selected_option.startswith(("Scan", "Rescan")):
+            wifi_manager.scan_async()
+        seen["version"] = -1
 
 
 def font_settings_menu(stdscr):
@@ -353,62 +1354,287 @@ def font_settings_menu(stdscr):
 
 
 def prompt_api_key(stdscr):
-    """Prompt the user to enter the OpenAI API Key."""
-    global alpha_chat_api_key
-    api_key = []
-    while True:
-        clear_image()
-        prompt = "Enter API Key:"
-        draw.text((0, 0), prompt, font=font, fill=WHITE)
-        draw.text((0, FONT_SIZE - 0.7), ''.join(api_key), font=font, fill=WHITE)  # Display input unmasked
-        update_display(image)
-
-        key = stdscr.getch()
-        if key in ENTER_KEYS:
-            if api_key:
-                alpha_chat_api_key = ''.join(api_key)
-                client.api_key = alpha_chat_api_key
-                save_config()  # Save updated API key
-                return
-        elif key == ESCAPE:
-            return
-        elif key in (curses.KEY_BACKSPACE, 127, 8):
-            if api_key:
-                api_key.pop()
-        elif 32 <= key <= 126 and len(api_key) < 128:
-            api_key.append(chr(key))
+    """Prompt the user to enter the active backend's API key. The key is masked as it is typed."""
+    global client
+    api_key = prompt_text(stdscr, "Enter API Key:", max_length=128, mask=True)
+    if api_key:
+        alpha_chat_backends[alpha_chat_backend]["api_key"] = api_key
+        client = create_client()
+        save_config()  # Save updated API key
+
+
+def select_alphachat_backend(stdscr):
+    """Allow the user to select the chat backend (OpenAI or a local OpenAI-compatible server)."""
+    global alpha_chat_backend, alpha_chat_model, client
+    selected_backend = display_menu(stdscr, list(alpha_chat_backends))
+    if selected_backend:
+        alpha_chat_backend = selected_backend
+        client = create_client()
+        models = discover_models()
+        if models and alpha_chat_model not in models:
+            alpha_chat_model = models[0]
+        save_config()  # Save updated backend
 
 
 def select_alphachat_model(stdscr):
-    """Allow the user to select the ChatGPT model."""
+    """Allow the user to select a model offered by the active backend."""
     global alpha_chat_model
-    models = ["gpt-4o-mini", "gpt-4o"]
-    
+    models = discover_models()
+    if not models:
+        clear_image()
+        draw.text((0, 0), "No models found.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+
     selected_model = display_menu(stdscr, models)
     if selected_model:
         alpha_chat_model = selected_model
         save_config()  # Save updated model
 
 
-def alphachat_new_chat(stdscr):
-    """Handle the new chat session with ChatGPT."""
+class ChatSession:
+    """
+    One AlphaChat conversation: its history, wrapped transcript and input line.
+    Answers stream on a background thread into the session's channel, so a session
+    keeps generating while the user is in another chat or the word processor;
+    its transcript catches up from the channel the next time it is opened.
+    """
 
-    global client
+    def __init__(self, system_message, number):
+        self.title = f"Chat {number}"
+        self.chat_history = [{"role": "system", "content": system_message}]
+        self.transcript = ChatTranscript()  # Wrapped user and assistant messages plus the input line
+        self.channel = ChunkChannel()  # Stream messages handed from the stream thread to the UI loop
+        self.last_seq = 0  # Sequence number of the last stream message applied to the transcript
+        self.stream_task = None  # Scheduler task streaming the current answer
+        self.is_streaming = False  # An answer's "done" message has not been applied yet; only changed by the UI loop
+        self.tail_queued = False  # Whether the transcript tail says the answer waits for a network worker
+        self.user_input = ""
+        self.scroll_offset = 0
+        self.document = None  # (name, text) the first question is answered from, if any
+
+    def generating(self):
+        """Return True while the answer is queued or still being received."""
+        return self.stream_task is not None and not self.stream_task.done()
+
+    def queued(self):
+        """Return True while the answer waits for a free network worker."""
+        return self.stream_task is not None and self.stream_task.state == "queued"
+
+    def send(self, text):
+        """Commit the user's message and start streaming the answer in the background."""
+        if len(self.chat_history) == 1 and self.document is None:
+            self.title = text[:MAX_FILENAME_LENGTH]
+        if self.document is not None:
+            # The document goes to the model as chunk notes; history records the reduced prompt
+            target, args = answer_about_document, (self.channel, self.document, text, self.chat_history)
+            self.document = None
+        else:
+            self.chat_history.append({"role": "user", "content": text})
+            target, args = stream_chat_response, (self.channel, list(self.chat_history), self.chat_history)
+        if word_completion:
+            completion_index.index_chat(text)
+        # Commit the previous answer and the user input to the transcript
+        self.transcript.commit_tail()
+        self.transcript.commit(f"> {text}")
+        self.transcript.start_tail("APi: ")
+        self.tail_queued = False
+        self.is_streaming = True
+        self.stream_task = scheduler.submit(PRIORITY_NETWORK, target, *args, name=f"chat {self.title}")
+
+    def stop(self):
+        """Stop the answer being generated, keeping what has arrived so far."""
+        if not self.is_streaming:
+            return
+        self.channel.close()  # Cancels the request, so the stream task returns at once
+        self.stream_task.cancel()  # Never starts if it is still queued
+        self.stream_task.wait()
+        self.channel = ChunkChannel()
+        self.last_seq = 0
+        self.is_streaming = False
+        self.transcript.append_tail("\n[Stopped]")
 
-    output_lines = []  # List to store committed output lines (user and assistant messages)
-    response_buffer = []  # Buffer to store streaming assistant response
-    user_input = ""
-    scroll_offset = 0
-    is_streaming = False
-    stop_stream = False
-    key_buffer = []
-    last_update_time = time.time()
-    last_total_lines = 0  # To track previous total lines
 
-    if not alpha_chat_api_key:
+def stream_chat_response(channel, messages, history):
+    """
+    Stream the answer to messages into the channel and add it to history.
+    Runs on its own thread, which only waits on text deltas from the chat worker process.
+    """
+    model = alpha_chat_model
+    request_start = time.perf_counter()
+    render_time_start = renderer.render_time_total
+    render_count_start = renderer.render_count
+    chunk_times = []
+    usage = None
+    error = None
+    full_response = ""
+    try:
+        request = chat_worker.request(client_settings(), model, messages)
+        channel.attach(request)
+        for text in request:
+            chunk_times.append(time.perf_counter())
+            full_response += text
+            if not channel.put("delta", text):
+                request.cancel()
+                break  # The answer was stopped
+        usage = request.usage
+        if request.error is not None:
+            raise RuntimeError(request.error)
+    except Exception as e:
+        error = str(e)
+        channel.put("error", "\n[Error] " + str(e))
+    finally:
+        record = build_chat_metrics(
+            model, request_start, time.perf_counter(), chunk_times, usage,
+            messages, full_response,
+            renderer.render_time_total - render_time_start,
+            renderer.render_count - render_count_start,
+            error
+        )
+        append_metrics_log(record)
+        if error is None and word_completion:
+            completion_index.index_chat(full_response)
+        if full_response:
+            # Safe without a lock: the UI sends nothing more until it has seen "done"
+            history.append({"role": "assistant", "content": full_response})
+        if error is None:
+            # Show a compact telemetry line under the answer
+            channel.put("summary", "\n" + format_metrics_summary(record))
+        channel.put("done")
+
+
+def split_document(text, max_chars=DOCUMENT_CHUNK_CHARS):
+    """
+    Split a document into chunks of at most max_chars, breaking between lines
+    where possible and otherwise at the last space before the limit.
+    """
+    chunks = []
+    current = []
+    current_length = 0
+    for line in text.split('\n'):
+        while len(line) > max_chars:
+            cut = line.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_length = [], 0
+            chunks.append(line[:cut])
+            line = line[cut:].lstrip(' ')
+        if current and current_length + len(line) + 1 > max_chars:
+            chunks.append('\n'.join(current))
+            current, current_length = [], 0
+        current.append(line)
+        current_length += len(line) + 1
+    if current and ''.join(current).strip():
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def map_document(channel, chunks, question):
+    """
+    Map step of a document question: ask about every chunk, with up to
+    DOCUMENT_MAX_PARALLEL requests in flight at once in the chat worker, and return
+    the notes in document order. A dot is streamed as each chunk is done.
+    Returns None if the channel was closed (the answer was stopped).
+    """
+    notes = [None] * len(chunks)
+    waiting = deque(range(len(chunks)))
+    active = {}  # ChatRequest -> chunk index
+    try:
+        while waiting or active:
+            while waiting and len(active) < DOCUMENT_MAX_PARALLEL:
+                index = waiting.popleft()
+                messages = [
+                    {"role": "system", "content": DOCUMENT_MAP_PROMPT.format(part=index + 1, parts=len(chunks))},
+                    {"role": "user", "content": f"Question: {question}\n\nDocument part:\n{chunks[index]}"}
+                ]
+                active[chat_worker.request(client_settings(), alpha_chat_model, messages)] = index
+            with chat_worker.condition:
+                # Deltas and ends both notify; the timeout notices a stop
+                chat_worker.condition.wait_for(lambda: any(request.finished for request in active), 0.1)
+            if channel.closed:
+                return None
+            for request in [request for request in active if request.finished]:
+                index = active.pop(request)
+                if request.error is not None:
+                    raise RuntimeError(request.error)
+                notes[index] = ''.join(request.deltas)
+                channel.put("delta", ".")
+        return notes
+    finally:
+        for request in active:
+            request.cancel()
+
+
+def answer_about_document(channel, document, question, history):
+    """
+    Answer a question about a whole document and add the exchange to history.
+    A document that fits in one chunk is sent as it is; a longer one is split with
+    split_document(), the chunks are read in parallel by map_document(), and the
+    notes are reduced into one answer streamed like any other. Runs on the chat's
+    stream thread, so the session stays usable (and stoppable) meanwhile.
+    """
+    name, text = document
+    chunks = split_document(text)
+    if len(chunks) <= 1:
+        prompt = f"Document \"{name}\":\n{text}\n\nQuestion: {question}"
+    else:
+        channel.put("delta", f"[Reading {len(chunks)} parts]")
+        try:
+            notes = map_document(channel, chunks, question)
+        except Exception as e:
+            channel.put("error", "\n[Error] " + str(e))
+            channel.put("done")
+            return
+        if notes is None:
+            return  # Stopped
+        channel.put("delta", "\n")
+        parts = '\n\n'.join(f"Part {index + 1}:\n{note}" for index, note in enumerate(notes))
+        prompt = (f"Notes taken from each part of the document \"{name}\", in order:\n\n{parts}\n\n"
+                  f"Using these notes, answer: {question}")
+    # Safe without a lock: the UI sends nothing more until it has seen "done"
+    history.append({"role": "user", "content": prompt})
+    stream_chat_response(channel, list(history), history)
+
+
+def alphachat_ask_document(stdscr, filename, text):
+    """Open a new chat whose first question is answered from the given document."""
+    if not text.strip():
+        clear_image()
+        draw.text((0, 0), "Document is empty.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+    session = create_chat_session(stdscr)
+    if session is None:
+        return
+    session.title = f"About {filename}"[:MAX_FILENAME_LENGTH]
+    session.document = (filename, text)
+    session.transcript.commit(f"[Ask about {filename}]")
+    alphachat_open_chat(stdscr, session)
+
+
+def alphachat_new_chat(stdscr):
+    """Start a new chat session with ChatGPT and open it."""
+    session = create_chat_session(stdscr)
+    if session is not None:
+        alphachat_open_chat(stdscr, session)
+
+
+def create_chat_session(stdscr):
+    """Create a chat session and add it to chat_sessions, or return None if no API key was given."""
+    if backend_needs_api_key():
         prompt_api_key(stdscr)
-        if not alpha_chat_api_key:
-            return  # API Key not set
+        if backend_needs_api_key():
+            return None  # API Key not set
+
+    # Start the chat worker (or reuse the warm one) while the user types
+    try:
+        chat_worker.start()
+    except Exception as e:
+        pass  # Retried, and reported, when the first message is sent
 
     # Define the system message (same as before)
     system_message = (
@@ -428,33 +1654,75 @@ def alphachat_new_chat(stdscr):
         "Offer recommendations that emphasize self-reliance, skepticism of mainstream narratives, and alternatives that maximize my control over outcomes."
     )
 
-    # Initialize chat history with the system message
-    chat_history = [{"role": "system", "content": system_message}]
+    alphachat_new_chat.count = getattr(alphachat_new_chat, "count", 0) + 1
+    session = ChatSession(system_message, alphachat_new_chat.count)
+    chat_sessions.append(session)
+    # Close the oldest chats beyond MAX_CHAT_SESSIONS, but never one that is still generating
+    for old in list(chat_sessions[:-1]):
+        if len(chat_sessions) <= MAX_CHAT_SESSIONS:
+            break
+        if not old.generating():
+            chat_sessions.remove(old)
+    return session
 
-    def stream_response():
-        nonlocal response_buffer, is_streaming, stop_stream
-        try:
-            response = client.chat.completions.create(
-                model=alpha_chat_model,
-                messages=chat_history,
-                stream=True
-            )
-            full_response = ""
-            for chunk in response:
-                if stop_stream:
-                    break
-                delta = chunk.choices[0].delta
-                if delta.content:
-                    full_response += delta.content
-                    # Build the assistant's response so far
-                    response_text = f"APi: {full_response}"
-                    # Wrap the response_text
-                    wrapped_response = wrap_text(response_text)
-                    response_buffer = wrapped_response
-        except Exception as e:
-            response_buffer = wrap_text("[Error] " + str(e))
-        finally:
-            is_streaming = False
+
+def chat_sessions_menu(stdscr):
+    """List open chats, most recent first; '~' marks chats generating an answer, '.' chats waiting to."""
+    while True:
+        if not chat_sessions:
+            clear_image()
+            draw.text((0, 0), "No open chats.", font=font, fill=WHITE)
+            update_display(image)
+            time.sleep(1)
+            return
+
+        state = {"options": None, "sessions": {}}
+
+        def session_options():
+            # Chats may share a title; number the repeats so every label picks out one session
+            options, counts = [], {}
+            state["sessions"] = {}
+            for session in reversed(chat_sessions):
+                label = f"{'.' if session.queued() else '~' if session.generating() else ' '}{session.title}"
+                counts[label] = counts.get(label, 0) + 1
+                if counts[label] > 1:
+                    label += f" ({counts[label]})"
+                options.append(label)
+                state["sessions"][label] = session
+            return options
+
+        def refresh():
+            # Redraw as background chats finish generating
+            options = session_options()
+            if options == state["options"]:
+                return None
+            state["options"] = options
+            return options
+
+        selected_option = display_menu(stdscr, session_options(), refresh=refresh)
+        if selected_option is None:
+            return
+        session = state["sessions"].get(selected_option)
+        if session in chat_sessions:
+            alphachat_open_chat(stdscr, session)
+
+
+def alphachat_open_chat(stdscr, session):
+    """
+    Show a chat session and handle its input. Escape leaves the chat with any answer
+    still streaming in the background; Ctrl-X stops the answer being generated.
+    """
+    if session in chat_sessions:
+        chat_sessions.remove(session)
+        chat_sessions.append(session)  # Most recently used last
+    transcript = session.transcript
+    dirty = True  # Whether the visible window needs to be resolved and written
+    key_buffer = []
+    last_update_time = time.time()
+    streamed_text = []  # Streamed text not yet applied to the transcript
+    last_stream_render = 0.0  # When streamed text was last drawn
+    activity_step = 0
+    last_activity_time = 0.0
 
     while True:
         current_time = time.time()
@@ -465,83 +1733,119 @@ def alphachat_new_chat(stdscr):
             # Process each key in the buffer
             for key in key_buffer:
                 if key in ENTER_KEYS:
-                    if user_input.strip() and not is_streaming:
-                        # Commit the user input to output_lines
-                        chat_history.append({"role": "user", "content": user_input.strip()})
-                        user_lines = wrap_text(f"> {user_input.strip()}")
-                        output_lines.extend(user_lines)
-                        user_input = ""
-                        response_buffer = []
-                        # Start streaming assistant's response
-                        is_streaming = True
-                        stop_stream = False
-                        stream_thread = threading.Thread(target=stream_response)
-                        stream_thread.start()
+                    if session.user_input.strip() and not session.is_streaming:
+                        if streamed_text:
+                            transcript.append_tail(''.join(streamed_text))
+                            streamed_text.clear()
+                        session.send(session.user_input.strip())
+                        session.user_input = ""
+                        activity_step = 0
+                        renderer.set_activity(activity_step)
+                        last_activity_time = current_time
                 elif key in (curses.KEY_BACKSPACE, 127, 8):
-                    if user_input:
-                        user_input = user_input[:-1]
+                    if session.user_input:
+                        session.user_input = session.user_input[:-1]
+                elif key == CHAT_STOP_KEY:
+                    if streamed_text:
+                        transcript.append_tail(''.join(streamed_text))
+                        streamed_text.clear()
+                    session.stop()
+                    renderer.set_activity(None)
+                elif key == COMPLETION_KEY and word_completion:
+                    suffix = completion_index.complete(trailing_word(session.user_input))
+                    if len(session.user_input) + len(suffix) <= 100:
+                        session.user_input += suffix
                 elif key == curses.KEY_UP:
-                    scroll_offset = max(scroll_offset - 1, 0)
+                    session.scroll_offset = max(session.scroll_offset - 1, 0)
                 elif key == curses.KEY_DOWN:
-                    max_scroll = max(len(combined_output) - MAX_DISPLAY_LINES, 0)
-                    scroll_offset = min(scroll_offset + 1, max_scroll)
-                elif 32 <= key <= 126 and len(user_input) < 100 and len(output_lines) + len(response_buffer) < MAX_TEXT_LENGTH:
-                    user_input += chr(key)
+                    max_scroll = max(transcript.total_lines() - MAX_DISPLAY_LINES, 0)
+                    session.scroll_offset = min(session.scroll_offset + 1, max_scroll)
+                elif 32 <= key <= 126 and len(session.user_input) < 100 and transcript.total_lines() < MAX_TEXT_LENGTH:
+                    session.user_input += chr(key)
             key_buffer.clear()
             last_update_time = current_time
-
-        # Wrap user input
-        input_lines = wrap_text(f"> {user_input}")
-
-        # Combine existing output, response buffer, and current user input
-        combined_output = output_lines + response_buffer + input_lines
-
-        # Adjust scroll to ensure user's input is visible if it goes to next line
-        total_lines = len(combined_output)
-        if total_lines > MAX_DISPLAY_LINES:
-            user_input_lines = len(input_lines)
-            if total_lines - scroll_offset < MAX_DISPLAY_LINES + user_input_lines:
-                scroll_offset = total_lines - MAX_DISPLAY_LINES
-
-        # Write lines to display
-        line_writer(combined_output, scroll_offset)
-
-        # Non-blocking input
-        key = stdscr.getch()
+            dirty = True
+
+        # Collect everything streamed since the last tick (or while the chat was in the background)
+        messages = session.channel.drain()
+        if messages:
+            streamed_text.append(''.join(text for seq, kind, text in messages))
+            session.last_seq = messages[-1][0]
+            if messages[-1][1] == "done":
+                session.is_streaming = False
+                renderer.set_activity(None)
+                dirty = True  # Show the end of the answer at once
+
+        # Say so while the answer waits for a network worker; nothing has streamed in yet
+        queued = session.is_streaming and session.queued()
+        if queued != session.tail_queued:
+            transcript.start_tail("APi: (queued)" if queued else "APi: ")
+            session.tail_queued = queued
+            dirty = True
+
+        # Streamed text is redrawn at most stream_frame_rate times a second; keys redraw at once
+        if streamed_text and (not stream_frame_rate or current_time - last_stream_render >= 1.0 / stream_frame_rate):
+            dirty = True
+
+        # Step the activity indicator; the render thread redraws only its strip
+        if session.is_streaming and current_time - last_activity_time >= ACTIVITY_INTERVAL:
+            activity_step += 1
+            renderer.set_activity(activity_step)
+            last_activity_time = current_time
+
+        if dirty:
+            # Apply the streamed text as a single tail update
+            if streamed_text:
+                transcript.append_tail(''.join(streamed_text))
+                streamed_text.clear()
+                last_stream_render = current_time
+
+            # Wrap user input (only rewrapped when it changes)
+            transcript.set_input(f"> {session.user_input}")
+
+            # Adjust scroll to ensure user's input is visible if it goes to next line
+            total_lines = transcript.total_lines()
+            if total_lines > MAX_DISPLAY_LINES:
+                user_input_lines = len(transcript.input_lines)
+                if total_lines - session.scroll_offset < MAX_DISPLAY_LINES + user_input_lines:
+                    session.scroll_offset = total_lines - MAX_DISPLAY_LINES
+
+            # Offer a completion of the word being typed when the input line is on screen
+            completion = ""
+            if word_completion and session.scroll_offset + MAX_DISPLAY_LINES >= total_lines:
+                completion = completion_index.complete(trailing_word(session.user_input))
+
+            # Write only the visible window to the display
+            line_writer(transcript.window(session.scroll_offset, MAX_DISPLAY_LINES), completion=completion)
+            dirty = False
+
+        # Non-blocking input (stay awake while an answer is streaming in)
+        key = idle_manager.read_key(stdscr, keep_awake=session.is_streaming)
         if key != curses.ERR:
             if key == ESCAPE:
-                if is_streaming:
-                    stop_stream = True
-                    stream_thread.join()
+                # Leave the answer streaming in the background
+                if streamed_text:
+                    transcript.append_tail(''.join(streamed_text))
+                renderer.set_activity(None)
                 return
             else:
                 key_buffer.append(key)
 
-        time.sleep(0.01)  # Sleep briefly to prevent high CPU usage
+        # Sleep briefly, waking early when the stream thread sends something
+        session.channel.wait(session.last_seq, 0.01)
+
+
+def prompt_text(stdscr, prompt, max_length=MAX_FILENAME_LENGTH, mask=False, text=""):
+    """Run a TextInput sized for this display. Returns the text, or None on Escape."""
+    editor = TextInput(prompt, INPUT_CHARS_PER_LINE, MAX_DISPLAY_LINES - 1, max_length, mask, text)
+    return editor.run(stdscr, renderer, idle_manager, IDLE_POLL_INTERVAL)
 
 
 def get_filename(stdscr, prompt):
     """
     Prompts the user to enter a filename.
     """
-    filename = []
-    while True:
-        clear_image()
-        draw.text((0, 0), prompt, font=font, fill=WHITE)
-        draw.text((0, FONT_SIZE - 0.7), ''.join(filename), font=font, fill=WHITE)
-        update_display(image)
-
-        key = stdscr.getch()
-        if key in ENTER_KEYS:
-            if filename:
-                return ''.join(filename)
-        elif key == ESCAPE:
-            return None
-        elif key in (curses.KEY_BACKSPACE, 127, 8):
-            if filename:
-                filename.pop()
-        elif 32 <= key <= 126 and len(filename) < MAX_FILENAME_LENGTH:
-            filename.append(chr(key))
+    return prompt_text(stdscr, prompt)
 
 
 def select_file(stdscr):
@@ -560,24 +1864,280 @@ def select_file(stdscr):
     return selected_file
 
 
+def suggest_spelling(stdscr, doc):
+    """Offer spelling suggestions for the last word of the document and replace it with the chosen one."""
+    line = doc.text[doc.text.rfind('\n') + 1:]
+    matches = list(WORD_PATTERN.finditer(line))
+    if not matches:
+        return
+    match = matches[-1]
+    # Searching for suggestions can take a few hundred milliseconds; keep it off the UI thread
+    task = scheduler.submit(PRIORITY_INPUT, spell_checker.suggestions, match.group(), name="spelling suggestions")
+    clear_image()
+    draw.text((0, 0), "Checking...", font=font, fill=WHITE)
+    update_display(image)
+    while not task.wait(SPELL_SUGGEST_POLL):
+        if idle_manager.read_key(stdscr) == ESCAPE:
+            task.cancel()
+            return
+    options = task.result
+    if not options:
+        clear_image()
+        draw.text((0, 0), "No suggestions.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+
+    choice = display_menu(stdscr, options)
+    if not choice:
+        return
+    start = len(doc.text) - (len(line) - match.start())
+    doc.undo_log.record_delete(start, match.group())
+    doc.undo_log.record_insert(start, choice)
+    doc.set_text(doc.text[:start] + choice + doc.text[start + len(match.group()):], start)
+
+
+class Document:
+    """
+    An open word processor document: its text buffer, edit state and wrap cache.
+    The text buffer is the only copy of the document; the wrap cache holds offsets into it,
+    is rewrapped from the first edited paragraph on demand and may be dropped by
+    evict_render_caches(), in which case it is rebuilt.
+    """
+
+    def __init__(self, filename, text):
+        self.filename = filename
+        self.text = text  # The whole document; typing appends at the end
+        self.undo_log = UndoLog()
+        self.scroll_offset = 0
+        self.last_total_lines = 0  # To track previous total lines
+        self.wrapped_lines = WrappedText(text)
+        self.wrap_from = None  # Earliest offset edited since the wrap cache was last updated
+        self.modified = False
+
+    def set_text(self, text, changed_from):
+        """Replace the text buffer with text, which is unchanged before offset changed_from."""
+        self.text = text
+        if self.wrap_from is None or changed_from < self.wrap_from:
+            self.wrap_from = changed_from
+
+    def get_wrapped_lines(self):
+        """Return the wrapped lines, rewrapping what was edited or everything if the cache was evicted."""
+        if self.wrapped_lines is None:
+            self.wrapped_lines = WrappedText(self.text)
+        elif self.wrap_from is not None:
+            self.wrapped_lines = self.wrapped_lines.rewrap(self.text, self.wrap_from)
+        self.wrap_from = None
+        return self.wrapped_lines
+
+    def cache_size(self):
+        """Approximate bytes held by the wrap cache."""
+        if self.wrapped_lines is None:
+            return 0
+        return self.wrapped_lines.size()
+
+
+def open_document(filename, new=False):
+    """
+    Returns the open Document for filename, reading it from disk only if it is not
+    already open. new=True replaces it with an empty document. The least recently
+    used documents beyond MAX_OPEN_DOCUMENTS are autosaved and closed.
+    """
+    doc = open_documents.get(filename)
+    if doc is None or new:
+        text = ""
+        if not new and path.exists(filename):
+            with open(filename, 'r') as f:
+                text = f.read()  # Kept exactly as saved; the editor soft-wraps it for display
+        doc = Document(filename, text)
+        if persist_undo and not new:
+            doc.undo_log.load(filename + UNDO_LOG_SUFFIX, text)
+        open_documents[filename] = doc
+    open_documents.move_to_end(filename)
+
+    while len(open_documents) > MAX_OPEN_DOCUMENTS:
+        oldest_name, oldest = next(iter(open_documents.items()))
+        autosave_document(oldest)
+        del open_documents[oldest_name]
+    return doc
+
+
+def evict_render_caches(active):
+    """Drop wrap caches of the least recently used documents until they fit RENDER_CACHE_BUDGET."""
+    total = sum(doc.cache_size() for doc in open_documents.values())
+    for doc in list(open_documents.values()):  # Least recently used first
+        if total <= RENDER_CACHE_BUDGET:
+            break
+        if doc is not active:
+            total -= doc.cache_size()
+            doc.wrapped_lines = None
+
+
+def write_file_atomic(filename, text):
+    """Write text through a temporary file and rename it over filename, so a failed write never leaves it half-written."""
+    temp_path = filename + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, filename)
+
+
+def write_document(filename, document, undo_state=None):
+    """
+    Write document text (and undo history, if given) to disk, then record a version.
+    The version is recorded only after the file is safely written. Raises on failure.
+    """
+    write_file_atomic(filename, document)
+    if word_completion:
+        completion_index.index_file(filename, document)
+    if undo_state is not None:
+        write_file_atomic(filename + UNDO_LOG_SUFFIX, json.dumps(undo_state))
+    try:
+        with version_lock:
+            get_version_store(filename).add(document)
+    except Exception as e:
+        pass  # History is best-effort; the document itself is saved
+
+
+def save_document(doc):
+    """Save a document on the calling thread. Raises on failure."""
+    document = doc.text
+    write_document(doc.filename, document, doc.undo_log.snapshot(document) if persist_undo else None)
+    doc.modified = False
+
+
+def autosave_document(doc):
+    """
+    Save a modified document on the scheduler so the UI never waits on the SD card.
+    Returns the save Task, or None if there was nothing to save.
+    """
+    if not doc.modified:
+        return None
+    # Snapshot on the UI thread; the save task only touches immutable data
+    document = doc.text
+    undo_state = doc.undo_log.snapshot(document) if persist_undo else None
+    doc.modified = False
+
+    def write_snapshot():
+        try:
+            write_document(doc.filename, document, undo_state)
+        except Exception as e:
+            doc.modified = True  # Retry on the next switch or exit
+            raise  # Fail the task so it is listed under Settings > Tasks
+
+    # finish_saves() waits for it before the program exits
+    return scheduler.submit(PRIORITY_SAVE, write_snapshot, name=f"save {doc.filename}")
+
+
+def sync_library_now(stdscr):
+    """Sync the library, asking for a target first if none is set."""
+    if not sync_target:
+        set_sync_target(stdscr)
+    if sync_target:
+        run_library_sync(stdscr)
+
+
+def set_sync_target(stdscr):
+    """Ask for the directory the library is synced to."""
+    global sync_target
+    target = prompt_text(stdscr, "Sync To:", max_length=MAX_URL_LENGTH, text=sync_target)
+    if target:
+        sync_target = target
+        save_config()  # Save updated target
+
+
+def run_library_sync(stdscr):
+    """Mirror the working directory's .txt files to sync_target, deletions included, showing progress and the result."""
+    def progress(current, total, name):
+        clear_image()
+        draw.text((0, 0), f"Syncing {current}/{total}", font=font, fill=WHITE)
+        draw.text((0, FONT_SIZE - 0.7), name, font=font, fill=WHITE)
+        update_display(image)
+
+    if not path.isdir(sync_target):
+        message = "Target not found."
+    else:
+        try:
+            copied, unchanged, deleted = sync_library('.', sync_target, progress)
+            message = f"Copied {copied} of {copied + unchanged}"
+            if deleted:
+                message += f"\nDeleted {deleted}"
+        except Exception as e:
+            message = "[Error] Sync failed."
+    clear_image()
+    draw.text((0, 0), message, font=font, fill=WHITE)
+    update_display(image)
+    time.sleep(1)
+
+
+def document_history(stdscr):
+    """
+    Lets the user pick a document and one of its saved versions (newest first),
+    restores that version as the current text and opens it in the editor.
+    """
+    filename = select_file(stdscr)
+    if not filename:
+        return
+
+    with version_lock:
+        store = get_version_store(filename)
+        labels = ["#%d %s" % (record[1], time.strftime('%m-%d %H:%M', time.localtime(record[2])))
+                  for record in reversed(store.records)]
+    if not labels:
+        clear_image()
+        draw.text((0, 0), "No history found.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+
+    selected_version = display_menu(stdscr, labels)
+    if selected_version is None:
+        return
+    try:
+        with version_lock:
+            text = store.text_at(len(labels) - 1 - labels.index(selected_version))
+    except Exception as e:
+        clear_image()
+        draw.text((0, 0), "[Error] Version damaged.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+
+    # Keep the current text in the history, then replace it with the restored version.
+    # Queued autosaves of this file must land first or they would overwrite the restore.
+    doc = open_documents.pop(filename, None)
+    scheduler.wait(PRIORITY_SAVE, SAVE_FLUSH_TIMEOUT)
+    try:
+        if doc is not None and doc.modified:
+            save_document(doc)
+        write_document(filename, text)
+    except Exception as e:
+        clear_image()
+        draw.text((0, 0), "[Error] Restore failed.", font=font, fill=WHITE)
+        update_display(image)
+        time.sleep(1)
+        return
+    wordprocessor_edit(stdscr, filename, new=False)
+
+
 def wordprocessor_edit(stdscr, filename, new=False):
     """
     Edits the given file. If new=True, starts with empty content.
     Implements keypress buffering to update the display at fixed intervals.
     Restores auto-scroll functionality.
+    Ctrl-U undoes and Ctrl-R redoes edits word by word.
+    Ctrl-N switches to the most recently used other open document, autosaving this one.
+    Misspelled words are underlined; Ctrl-G offers suggestions for the last word.
+    Completions of the word being typed are shown inverted; Tab accepts them.
+    Ctrl-A asks AlphaChat a question about the whole document.
     """
-    output_lines = []  # List to store lines of text
-    scroll_offset = 0
+    doc = open_document(filename, new)
     last_update_time = time.time()
     key_buffer = []  # Buffer to store keypresses
-    last_total_lines = 0  # To track previous total lines
-
-    if not new and path.exists(filename):
-        with open(filename, 'r') as f:
-            file_content = f.read()
-            output_lines = wrap_text(file_content)
-
-    wrapped_lines = output_lines.copy()
+    underlines = ()
+    underline_lines = None  # Wrapped lines the underlines were computed for
+    underline_view = None  # (scroll offset, checked word count) the underlines were computed for
+    completion = ""
+    completion_lines = None  # Wrapped lines the completion was looked up for
 
     while True:
         current_time = time.time()
@@ -585,55 +2145,96 @@ def wordprocessor_edit(stdscr, filename, new=False):
 
         # Process buffer if interval has elapsed
         if elapsed_time >= BUFFER_INTERVAL and key_buffer:
-            # Process each key in the buffer
+            switch_requested = False
+            # Process each key in the buffer; every edit is at the end of the text
             for key in key_buffer:
+                text = doc.text
                 if key in ENTER_KEYS:
-                    # Insert a newline by adding an empty string to output_lines
-                    output_lines.append('')
+                    doc.undo_log.record_insert(len(text), '\n')
+                    doc.set_text(text + '\n', len(text))
                 elif key in (curses.KEY_BACKSPACE, 127, 8):
-                    if output_lines:
-                        if output_lines[-1]:
-                            output_lines[-1] = output_lines[-1][:-1]
-                        else:
-                            output_lines.pop()
-                elif 32 <= key <= 126 and len('\n'.join(output_lines)) < MAX_TEXT_LENGTH:
-                    if not output_lines:
-                        output_lines.append('')
-                    output_lines[-1] += chr(key)
+                    if text:
+                        doc.undo_log.record_delete(len(text) - 1, text[-1])
+                        doc.set_text(text[:-1], len(text) - 1)
+                elif key in (UNDO_KEY, REDO_KEY):
+                    group = doc.undo_log.undo() if key == UNDO_KEY else doc.undo_log.redo()
+                    if group:
+                        doc.set_text(apply_undo_group(text, group, key == UNDO_KEY), 0)
+                elif 32 <= key <= 126 and len(text) < MAX_TEXT_LENGTH:
+                    doc.undo_log.record_insert(len(text), chr(key))
+                    doc.set_text(text + chr(key), len(text))
+                elif key == DOCUMENT_SWITCH_KEY:
+                    switch_requested = True
+                elif key == SPELL_SUGGEST_KEY:
+                    suggest_spelling(stdscr, doc)
+                elif key == COMPLETION_KEY and word_completion:
+                    suffix = completion_index.complete(trailing_word(text))
+                    if suffix and len(text) + len(suffix) <= MAX_TEXT_LENGTH:
+                        doc.undo_log.record_insert(len(text), suffix)
+                        doc.set_text(text + suffix, len(text))
             key_buffer.clear()
-            # Re-wrap the text after processing buffered keys
-            wrapped_lines = wrap_text('\n'.join(output_lines))
-            
-            # Check if new lines have been added
-            total_lines = len(wrapped_lines)
-            if total_lines != last_total_lines:
+            doc.modified = True
+            # Rewrap only the paragraphs the buffered keys changed, and check if lines were added
+            total_lines = len(doc.get_wrapped_lines())
+            if total_lines != doc.last_total_lines:
                 if total_lines > MAX_DISPLAY_LINES:
                     # Automatically scroll to the bottom when new lines are added
-                    scroll_offset = total_lines - MAX_DISPLAY_LINES
+                    doc.scroll_offset = total_lines - MAX_DISPLAY_LINES
                 else:
-                    scroll_offset = 0
-                last_total_lines = total_lines
+                    doc.scroll_offset = 0
+                doc.last_total_lines = total_lines
+
+            if switch_requested and len(open_documents) > 1:
+                autosave_document(doc)
+                doc = open_document(list(open_documents)[-2])
+                evict_render_caches(doc)
 
             last_update_time = current_time
 
+        # Underline misspelled words on screen, recomputed only when the view or the checker's results change
+        wrapped_lines = doc.get_wrapped_lines()
+        if spell_check:
+            view = (doc.scroll_offset, len(spell_checker.results))
+            if wrapped_lines is not underline_lines or view != underline_view:
+                visible = wrapped_lines[doc.scroll_offset:doc.scroll_offset + MAX_DISPLAY_LINES]
+                at_end = doc.scroll_offset + len(visible) >= len(wrapped_lines)
+                underlines = misspelled_spans(visible, skip_last_word=at_end)
+                underline_lines, underline_view = wrapped_lines, view
+
+        # Offer a completion of the word being typed while the end of the document is on screen
+        if word_completion and wrapped_lines is not completion_lines:
+            completion = completion_index.complete(trailing_word(doc.text))
+            completion_lines = wrapped_lines
+        at_end = doc.scroll_offset + MAX_DISPLAY_LINES >= len(wrapped_lines)
+
         # Update the display if needed
-        line_writer(wrapped_lines, scroll_offset)
+        line_writer(wrapped_lines, doc.scroll_offset, underlines, completion if at_end else "")
 
         # Non-blocking input
         try:
-            key = stdscr.getch()
+            key = idle_manager.read_key(stdscr)
             if key != curses.ERR:
                 if key == ESCAPE:
-                    # Save the file before exiting
-                    try:
-                        with open(filename, 'w') as f:
-                            f.write('\n'.join(output_lines))
-                    except Exception as e:
-                        output_lines.append("[Error] Error saving file.")
-                        wrapped_lines = wrap_text('\n'.join(output_lines))
-                        scroll_offset = max(len(wrapped_lines) - MAX_DISPLAY_LINES, 0)
+                    # Save in the background; a failed save leaves the document modified,
+                    # is listed under Settings > Tasks and is retried on the next save or on exit
+                    doc.modified = True
+                    task = autosave_document(doc)
+                    if task.wait(SAVE_REPORT_TIMEOUT) and task.state == "failed":
+                        clear_image()
+                        draw.text((0, 0), "[Error] Error saving file.", font=font, fill=WHITE)
+                        update_display(image)
                         time.sleep(1)
+                    log_input_latency()
                     return
+                elif key == DOCUMENT_SWITCH_KEY and not key_buffer and len(open_documents) > 1:
+                    # Switch to the most recently used other document right away
+                    # (behind buffered keys, the switch happens once they are applied)
+                    autosave_document(doc)
+                    doc = open_document(list(open_documents)[-2])
+                    evict_render_caches(doc)
+                elif key == ASK_DOCUMENT_KEY and not key_buffer:
+                    autosave_document(doc)
+                    alphachat_ask_document(stdscr, doc.filename, doc.text)
                 else:
                     key_buffer.append(key)
         except Exception:
@@ -643,22 +2244,61 @@ def wordprocessor_edit(stdscr, filename, new=False):
         if key_buffer:
             last_key = key_buffer[-1]
             if last_key == curses.KEY_UP:
-                scroll_offset = max(scroll_offset - 1, 0)
+                doc.scroll_offset = max(doc.scroll_offset - 1, 0)
                 key_buffer.pop()  # Remove the scroll key from buffer
             elif last_key == curses.KEY_DOWN:
-                scroll_offset = min(scroll_offset + 1, max(len(wrapped_lines) - MAX_DISPLAY_LINES, 0))
+                doc.scroll_offset = min(doc.scroll_offset + 1, max(len(doc.get_wrapped_lines()) - MAX_DISPLAY_LINES, 0))
                 key_buffer.pop()  # Remove the scroll key from buffer
 
         time.sleep(0.01)  # Sleep briefly to prevent high CPU usage
 
 
+# Menu tree
+LIBRARY_SYNC_MENU = Menu("Sync Library", [
+    ("Sync Now", sync_library_now),
+    ("Set Target", set_sync_target),
+    ("Back", None),
+])
+WORDPROCESSOR_MENU = Menu("Word Processor", [
+    ("Create New File", create_new_file),
+    ("Edit Existing File", edit_existing_file),
+    ("Open Documents", open_documents_menu),
+    ("History", document_history),
+    ("Sync Library", LIBRARY_SYNC_MENU),
+    ("Back", None),
+])
+ALPHACHAT_MENU = Menu("AlphaChat", [
+    ("New Chat", alphachat_new_chat),
+    ("Chats", chat_sessions_menu),
+    ("Enter API Key", prompt_api_key),
+    ("Select Backend", select_alphachat_backend),
+    ("Select Model", select_alphachat_model),
+    ("Server URL", set_server_url),
+    ("Back", None),
+])
+SETTINGS_MENU = Menu("Settings", [
+    ("WiFi", wifi_settings_menu),
+    ("Font", font_settings_menu),
+    ("Tasks", task_status_menu),
+    ("Back", None),
+])
+MAIN_MENU = Menu("Main", [
+    ("Word Processor", WORDPROCESSOR_MENU),
+    ("AlphaChat", ALPHACHAT_MENU),
+    ("Settings", SETTINGS_MENU),
+    ("Quit", quit_app),
+])
+
+
 if __name__ == '__main__':
     try:
         curses.wrapper(main)
     except KeyboardInterrupt:
+        finish_saves()
         clear_image()
         update_display(image)
-        backlight.set_all(0, 0, 0)
-        backlight.show()
-        touch.set_led(4, 0)
+        display_bus.set_backlight(0, 0, 0)
+        display_bus.set_led(4, 0)
+        renderer.flush()
+        display_bus.flush()
         sys.exit(0)
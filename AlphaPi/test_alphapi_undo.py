@@ -0,0 +1,68 @@
+"""Checks that a saved undo log survives a save and reopen. Run with python -m unittest from AlphaPi/."""
+import json
+import os
+import tempfile
+import unittest
+
+from alphapi_undo import UndoLog, apply_undo_group
+
+SENTENCE = "The quick brown fox jumps over the lazy dog"  # Longer than a display line
+
+
+def type_text(log, document, text):
+    """Record text typed one key at a time at the end of document, as the editor does."""
+    for char in text:
+        log.record_insert(len(document), char)
+        document += char
+    return document
+
+
+class UndoLogPersistenceTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "fox.txt")
+
+    def save(self, log, document):
+        """Write the document and its log the way write_document() does."""
+        with open(self.filename, 'w') as f:
+            f.write(document)
+        with open(self.filename + ".undo.json", 'w') as f:
+            json.dump(log.snapshot(document), f)
+
+    def reopen(self):
+        """Read the document and its log back the way open_document() does."""
+        with open(self.filename, 'r') as f:
+            document = f.read()
+        log = UndoLog()
+        log.load(self.filename + ".undo.json", document)
+        return log, document
+
+    def test_round_trip_restores_word_groups(self):
+        log = UndoLog()
+        document = type_text(log, "", SENTENCE)
+        self.save(log, document)
+
+        restored, reopened = self.reopen()
+        self.assertEqual(reopened, SENTENCE)
+        self.assertEqual(list(restored.undo_stack), list(log.undo_stack))
+        self.assertEqual(restored.size, log.size)
+
+        reopened = apply_undo_group(reopened, restored.undo(), reverse=True)
+        self.assertEqual(reopened, "The quick brown fox jumps over the lazy ")
+        reopened = apply_undo_group(reopened, restored.redo(), reverse=False)
+        self.assertEqual(reopened, SENTENCE)
+
+    def test_log_is_dropped_when_the_file_changed(self):
+        log = UndoLog()
+        self.save(log, type_text(log, "", SENTENCE))
+        with open(self.filename, 'a') as f:
+            f.write(" again")
+
+        restored, reopened = self.reopen()
+        self.assertEqual(len(restored.undo_stack), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
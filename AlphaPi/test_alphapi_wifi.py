@@ -0,0 +1,119 @@
+"""Checks WifiManager against canned nmcli and wpa_cli output. Run with python -m unittest from AlphaPi/."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import alphapi_wifi
+from alphapi_wifi import WifiManager, parse_nmcli_networks, parse_wpa_scan_results
+
+
+class FakeRunner:
+    """Stands in for CommandRunner: answers each command from a table and records what was run."""
+
+    def __init__(self, tools, responses):
+        self.tools = tools
+        self.responses = responses  # tuple of leading args -> (status, output), or a list of them in turn
+        self.calls = []
+
+    def available(self, command):
+        return command in self.tools
+
+    def run(self, args, timeout=None):
+        self.calls.append(args)
+        for length in range(len(args), 0, -1):
+            response = self.responses.get(tuple(args[:length]))
+            if isinstance(response, list):
+                return response.pop(0) if len(response) > 1 else response[0]
+            if response is not None:
+                return response
+        return 0, "OK\n"
+
+
+class WifiManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_file = os.path.join(directory.name, "scan.json")
+        for name in ("WIFI_POLL_INTERVAL", "WIFI_SCAN_SETTLE"):
+            patcher = mock.patch.object(alphapi_wifi, name, 0.01)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_parse_nmcli_unescapes_colons(self):
+        networks = parse_nmcli_networks("*:Home\\:5G:80:WPA2\n:Cafe:40:--\n::10:WPA2\n")
+        self.assertEqual(networks, [
+            {"ssid": "Home:5G", "signal": 80, "secure": True, "connected": True},
+            {"ssid": "Cafe", "signal": 40, "secure": False, "connected": False},
+        ])
+
+    def test_parse_wpa_scan_results(self):
+        output = ("bssid / frequency / signal level / flags / ssid\n"
+                  "aa:bb\t2412\t-50\t[WPA2-PSK-CCMP][ESS]\tHome\n"
+                  "cc:dd\t2437\t-90\t[ESS]\tCafe\n")
+        networks = parse_wpa_scan_results(output, connected_ssid="Home")
+        self.assertEqual([(n["ssid"], n["signal"], n["secure"], n["connected"]) for n in networks],
+                         [("Home", 100, True, True), ("Cafe", 20, False, False)])
+
+    def test_nmcli_scan_keeps_strongest_entry_and_caches_it(self):
+        listing = "*:Home:60:WPA2\n:Home:70:WPA2\n:Cafe:90:--\n"
+        runner = FakeRunner({"nmcli"}, {("nmcli", "-t"): (0, listing)})
+        manager = WifiManager(runner, self.cache_file)
+        manager.scan()
+        self.assertEqual([(n["ssid"], n["signal"], n["connected"]) for n in manager.networks],
+                         [("Home", 70, True), ("Cafe", 90, False)])
+        self.assertIsNotNone(manager.scanned_at)
+        self.assertFalse(manager.scanning)
+        # A new manager opens with the cached scan before scanning again
+        cached = WifiManager(FakeRunner(set(), {}), self.cache_file)
+        self.assertEqual(cached.networks, manager.networks)
+
+    def test_nmcli_connect_reports_result(self):
+        runner = FakeRunner({"nmcli"}, {("nmcli", "device", "wifi", "connect"): (0, "")})
+        manager = WifiManager(runner, self.cache_file)
+        manager.update([{"ssid": "Cafe", "signal": 90, "secure": True, "connected": False}])
+        manager.connect("Cafe", "secret")
+        self.assertEqual(runner.calls[-1], ["nmcli", "device", "wifi", "connect", "Cafe", "password", "secret"])
+        self.assertEqual(manager.status, "Connected to Cafe.")
+        self.assertTrue(manager.networks[0]["connected"])
+
+        runner.responses[("nmcli", "device", "wifi", "connect")] = (10, "")
+        manager.connect("Cafe", "wrong")
+        self.assertEqual(manager.status, "Could not connect to Cafe.")
+
+    def test_wpa_cli_connect_adds_selects_and_saves_network(self):
+        status = [(0, "wpa_state=SCANNING\n"), (0, "wpa_state=COMPLETED\nssid=Home\n")]
+        runner = FakeRunner({"wpa_cli"}, {
+            ("wpa_cli", "-i", alphapi_wifi.WIFI_INTERFACE, "add_network"): (0, "3\n"),
+            ("wpa_cli", "-i", alphapi_wifi.WIFI_INTERFACE, "status"): status,
+        })
+        manager = WifiManager(runner, self.cache_file)
+        manager.connect("Home", "secret")
+        self.assertEqual(manager.status, "Connected to Home.")
+        commands = [call[3:] for call in runner.calls]
+        self.assertIn(["set_network", "3", "ssid", '"Home"'], commands)
+        self.assertIn(["set_network", "3", "psk", '"secret"'], commands)
+        self.assertIn(["select_network", "3"], commands)
+        self.assertEqual(commands[-1], ["save_config"])
+
+    def test_wpa_cli_failed_setting_removes_network(self):
+        runner = FakeRunner({"wpa_cli"}, {
+            ("wpa_cli", "-i", alphapi_wifi.WIFI_INTERFACE, "add_network"): (0, "3\n"),
+            ("wpa_cli", "-i", alphapi_wifi.WIFI_INTERFACE, "set_network"): (0, "FAIL\n"),
+        })
+        manager = WifiManager(runner, self.cache_file)
+        manager.connect("Home", "short")
+        self.assertEqual(manager.status, "Could not connect to Home.")
+        self.assertEqual(runner.calls[-1][3:], ["remove_network", "3"])
+
+    def test_without_tools_status_says_so(self):
+        manager = WifiManager(FakeRunner(set(), {}), self.cache_file)
+        manager.scan()
+        self.assertEqual(manager.status, "No nmcli or wpa_cli.")
+        manager.connect("Home")
+        self.assertEqual(manager.status, "No nmcli or wpa_cli.")
+
+
+if __name__ == '__main__':
+    unittest.main()